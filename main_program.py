@@ -9,22 +9,27 @@ Transistor tools. This creates and controls the threads and GUI.
 
 import os
 import sys
+import time
+STARTED = time.monotonic() # for --startup-time
 import datetime
 import getpass
 from PyQt4.QtGui import *
 from PyQt4.QtCore import *
 import numpy as np
-import pandas as pd
 
-from src.inficon_engine import * # inficon engine (imports inficon drivers)
-from src.measurement_engine import * # conductivity engine (import Keithley drivers)
-from src.transistor_tools_GUI import * # GUI design created QtDesigner
+# The instrument engines (and with them pyvisa and pyserial), pandas and matplotlib are
+# imported where they are first used, so the window is shown before they are loaded.
+# python3 -m src.startup_benchmark reports what each import costs.
+from src.transistor_tools_GUI import * # GUI design created QtDesigner (plots load on first use)
 import src.Utilities as Utilities # utilities file mainly for handling fmf format
+import src.comm_stats as comm_stats # optional timing of instrument communication
+from src.parameters import MeasurementParameters # typed run parameters handed to the workers
+from src.ring_buffer import RingBuffer # fixed memory for live plots
+from src.live_plot import LivePlot # blitted graphs redrawn at a fixed rate
 
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as NavigationToolbar
-import matplotlib.pyplot as plt
-import src.matplotlibwidget
+DEPOSITION_PLOT_POINTS = 10000 # latest QCM samples shown in the deposition graph
+DEPOSITION_PLOT_RECORD = np.dtype([('time', 'f8'), ('thickness', 'f8', 4), ('rate', 'f8', 4)])
+IV_PLOT_SWEEPS = 16 # latest IV sweeps shown, one chip
 
 
 class programSetup(QObject):
@@ -66,23 +71,28 @@ class programSetup(QObject):
         self.gui.mainWindow.pushButtonSave.clicked.connect(self.gui.selectFile)
         self.gui.mainWindow.pushButton_save.clicked.connect(self.gui.getInputs)        
         self.gui.mainWindow.pushButton_load.clicked.connect(self.gui.restoreState) 
+        self.gui.startIV.connect(self.worker1.startWork)
         self.worker1.endData.connect(self.gui.saveIVData)
         self.worker1.newfixedVDataPoint.connect(self.gui.plotPoint)
         self.worker1.newIVData.connect(self.gui.plotIV)           
         self.signalStatus.connect(self.gui.updateStatus)
         # Inficon connections
-        self.gui.mainWindow.pushButton_QCMStart.clicked.connect(self.gui.getInputs) 
-        self.gui.mainWindow.pushButton_QCMStart.clicked.connect(self.worker2.startWork)
+        self.gui.mainWindow.pushButton_QCMStart.clicked.connect(self.gui.resetDepositionPlot)
+        self.gui.mainWindow.pushButton_QCMStart.clicked.connect(self.gui.resetInsituPlot)
+        self.gui.mainWindow.pushButton_QCMStart.clicked.connect(self.gui.startInficonRun)
+        self.gui.startInficon.connect(self.worker2.startWork)
         self.gui.mainWindow.pushButton_QCMStop.clicked.connect(self.forceWorkerReset2)
         self.worker2.endDepositionData.connect(self.gui.saveDepositionData)
         self.worker2.newDepositionDataPoint.connect(self.gui.plotDepositionPoint)
+        self.worker2.newInsituDataPoint.connect(self.gui.plotInsituPoint)
         # Transistor Conductivity Connections
-        self.gui.mainWindow.pushButton_cond_start.clicked.connect(self.gui.getInputs)
-        self.gui.mainWindow.pushButton_cond_start.clicked.connect(self.worker3.startWork)
+        self.gui.mainWindow.pushButton_cond_start.clicked.connect(self.gui.startConductivityRun)
+        self.gui.startConductivity.connect(self.worker3.startWork)
         self.gui.mainWindow.pushButton_cond_stop.clicked.connect(self.forceWorkerReset3)
         self.worker3.newIVData.connect(self.gui.plotIV)
         self.worker3.endIVData.connect(self.gui.saveIVData)
         self.worker3.endCondData.connect(self.gui.saveCondData)
+        self.worker3.endChipData.connect(self.gui.saveChipData)
         
         
         #General GUI connections
@@ -127,6 +137,8 @@ class programSetup(QObject):
             self.worker3.stopWork()
             #time.sleep(0.3) 
             self.worker_thread3.exit()        
+        if 'src.k2400_control' in sys.modules: # only if a Keithley was used
+            sys.modules['src.k2400_control'].smuSessions.closeAll() # release the Keithley connections
             
             
             
@@ -143,19 +155,24 @@ class IVWorker(QObject):
     def __init__(self, parent=None):
         super(self.__class__, self).__init__(parent)
         
-    @pyqtSlot()        
-    def startWork(self):
+    @pyqtSlot(object)        
+    def startWork(self, user_parameters):
         
+        from src.measurement_engine import IV_Engine # loads the Keithley drivers on the first run
         self._flag = False
-        self.user_parameters = pd.DataFrame.from_csv('src/df_measurement.csv', header=1) # Get input parameters from df_measurement
+        comm_stats.newRun() # only this run's instruments in the summary
+        self.user_parameters = user_parameters # MeasurementParameters snapshot from the GUI
         smu, rm = IV_Engine.connect2Keith(self)
         
-        if self.user_parameters.value['takeIVsweep'] == 'True':
+        if self.user_parameters.value['takeIVsweep']:
             v, i = IV_Engine.measure_IVsweep(self, smu)
         
-        if self.user_parameters.value['takefixedV'] == 'True':
+        if self.user_parameters.value['takefixedV']:
             v, i = IV_Engine.measure_fixedV(self, smu)
         
+        if comm_stats.stats:
+            self.IVConsole.emit(comm_stats.summary())
+        
         self.signalStatus.emit('Completed IV measurements')
     
     @pyqtSlot()
@@ -172,26 +189,57 @@ class ConductivityWorker(QObject):
     signalStatus = pyqtSignal(str)
     endIVData = pyqtSignal(object)
     endCondData = pyqtSignal(object)
+    endChipData = pyqtSignal(object)
     askParameters = pyqtSignal(object)   
     newIVData = pyqtSignal(object)
     
     def __init__(self, parent=None):
         super(self.__class__, self).__init__(parent)
         
-    @pyqtSlot()        
-    def startWork(self):
-        
+    @pyqtSlot(object)        
+    def startWork(self, user_parameters):
+        import src.multi_smu as multi_smu # loads the Keithley drivers on the first run
+        from src.measurement_engine import Conductivity_Engine
         self._flag = False
+        comm_stats.newRun() # only this run's instruments in the summary
         self.signalStatus.emit('Conductivity thread running')
         self.progressBar.emit(0)
-        self.user_parameters = pd.DataFrame.from_csv('src/df_measurement.csv', header=1) # Get input parameters from df_measurement
-        smu, rm = Conductivity_Engine.connect2Keith(self)
-        Conductivity_Engine.measure(self, smu)
+        self.user_parameters = user_parameters # MeasurementParameters snapshot from the GUI
+        if multi_smu.parse_list(self.user_parameters.value['OFET_devices']) or multi_smu.parse_list(self.user_parameters.value['smuAddresses']):
+            self.measureChip() # device queue
+        else:
+            smu, rm = Conductivity_Engine.connect2Keith(self)
+            Conductivity_Engine.measure(self, smu)
+        if comm_stats.stats:
+            self.ConductivityConsole.emit(comm_stats.summary())
         self.signalStatus.emit('Completed')
+
+    def measureChip(self):
+        '''OFET_devices measured one after another, in parallel if smuAddresses has several SMUs'''
+        import src.multi_smu as multi_smu
+        self.executor = multi_smu.MultiSMUExecutor.fromParameters(self.user_parameters)
+        if self._flag:
+            self.executor.abort()
+        done = []
+        def newResult(name, kind, data):
+            if kind == 'IV':
+                self.newIVData.emit(data)
+            elif kind in ('console', 'error'):
+                self.ConductivityConsole.emit('%s: %s'%(name, data))
+            elif kind == 'conductivity':
+                done.append(name)
+                self.progressBar.emit(100*len(done)/len(self.executor.names))
+        record = self.executor.run(newResult)
+        self.ConductivityConsole.emit('Device \t Samples \t Conductivity [S/cm]')
+        for name, samples, mean, std in self.executor.summary():
+            self.ConductivityConsole.emit('%s \t %d \t %.3e +- %.1e'%(name, samples, mean*1e-2, std*1e-2))
+        self.endChipData.emit(record)
     
     @pyqtSlot()
     def stopWork(self):
         self._flag = True
+        if getattr(self, 'executor', None) is not None:
+            self.executor.abort()
         
 class inficonWorker(QObject):
     
@@ -199,17 +247,26 @@ class inficonWorker(QObject):
     InficonConsole = pyqtSignal(str)
     endDepositionData = pyqtSignal(object)
     newDepositionDataPoint = pyqtSignal(object)
+    newInsituDataPoint = pyqtSignal(object)
     #askParameters = pyqtSignal(object)
     
     def __init__(self, parent=None):
         super(self.__class__, self).__init__(parent)
         
-    @pyqtSlot()        
-    def startWork(self):
+    @pyqtSlot(object)        
+    def startWork(self, user_parameters):
         self._flag = False
+        comm_stats.newRun() # only this run's instruments in the summary
         self.signalStatus.emit('Inficon thread running...')
-        self.user_parameters = pd.DataFrame.from_csv('src/df_measurement.csv', header=1) # Get input parameters from df_measurement
-        thickness = inficon_engine.monitor_QCM(self)
+        self.user_parameters = user_parameters # MeasurementParameters snapshot from the GUI
+        if self.user_parameters.value['insitu']:
+            from src.insitu_engine import insitu_engine # loads the instrument drivers on the first run
+            insitu_engine.monitor(self) # Keithley readings joined with the QCM thickness
+        else:
+            from src.inficon_engine import inficon_engine # loads the inficon drivers on the first run
+            thickness = inficon_engine.monitor_QCM(self)
+        if comm_stats.stats:
+            self.InficonConsole.emit(comm_stats.summary())
         self.InficonConsole.emit('Thickness monitoring complete.')
         
     @pyqtSlot()
@@ -219,6 +276,10 @@ class inficonWorker(QObject):
 
 class mainWindow(QMainWindow):
     '''Main applicaiton window'''
+
+    startIV = pyqtSignal(object) # MeasurementParameters of the run
+    startConductivity = pyqtSignal(object)
+    startInficon = pyqtSignal(object)
     
     signalStatus = pyqtSignal(str)
 
@@ -233,10 +294,18 @@ class mainWindow(QMainWindow):
         #sys.stdout = EmittingStream(textWritten=self.write) #redirect console print to UI
         
         ### Widget and fmf definitions ###
-        self.inputManager = pd.DataFrame.from_csv('src/df_template.csv', header=1) # object for metadata
-        fields = list(self.inputManager.index) # create a list of the indices in the metadata file
+        self.inputManager = None # object for metadata, pandas DataFrame loaded on first use
+        self.depositionRun = False # getInputs for the QCM Start button, the only one that runs in-situ
+        fields = MeasurementParameters.keys('src/df_template.csv') # the indices in the metadata file
         self.inputWidgets = [w for w in self.findChildren(QWidget) if str(w.accessibleName()) in fields] # creates list of all QWidgets in GUI
-        mainWindow.setUpPlot(self)
+        QTimer.singleShot(0, self.setUpPlot) # once the window is shown, matplotlib loads then
+        
+    def loadInputManager(self):
+        ''' The metadata DataFrame, pandas is imported on the first call '''
+        if self.inputManager is None:
+            import pandas as pd #only needed once inputs are read
+            self.inputManager = pd.DataFrame.from_csv('src/df_template.csv', header=1)
+        return self.inputManager
         
         
     @pyqtSlot(str)
@@ -276,6 +345,7 @@ class mainWindow(QMainWindow):
     def getInputs(self):
         '''get measurement parameters from GUI and store in dataframe.'''
 
+        self.loadInputManager()
         for w in self.inputWidgets:
             try:
                 self.inputManager.loc[str(w.accessibleName())].value = Utilities.getWidgetValue(w)
@@ -304,10 +374,25 @@ class mainWindow(QMainWindow):
             self.inputManager.loc['finalV'].value = None
             self.inputManager.loc['stepSize'].value = None           
             self.inputManager.loc['holdTime'].value = None            
-            self.inputManager.loc['x_descript'].value = str('Sample')            
-            self.inputManager.loc['x_descript'].units = None     
+            self.inputManager.loc['x_descript'].value = str('Time') # instrument or sample clock time stamps
+            self.inputManager.loc['x_descript'].units = str('s')
             
-        if self.mainWindow.checkBox_IV.isChecked() == False and self.mainWindow.checkBox_fixedV.isChecked() == False:
+        if str(self.inputManager.loc['insitu'].value) == 'True' and not self.depositionRun:
+            self.inputManager.loc['insitu'].value = False # the checkbox only applies to deposition runs
+
+        if str(self.inputManager.loc['insitu'].value) == 'True': # fixed bias readings during deposition
+            self.inputManager.loc['setup'].value = str('InsituConductivity')
+            self.inputManager.loc['initialV'].value = None
+            self.inputManager.loc['finalV'].value = None
+            self.inputManager.loc['stepSize'].value = None           
+            self.inputManager.loc['holdTime'].value = None            
+            self.inputManager.loc['x_descript'].value = str('Time')  
+            self.inputManager.loc['x_descript'].units = str('s')
+            from src.insitu_engine import INSITU_COLUMNS # the run is about to load it anyway
+            self.inputManager.loc['y_descript'].value = str(', '.join(INSITU_COLUMNS[1:]))
+            self.inputManager.loc['y_descript'].units = str('kA, A/s, V, A, S/m')
+
+        elif self.mainWindow.checkBox_IV.isChecked() == False and self.mainWindow.checkBox_fixedV.isChecked() == False:
             self.inputManager.loc['setup'].value = str('DepositionMonitoring')
             self.inputManager.loc['fixedV'].value = None
             self.inputManager.loc['nRepeats'].value = None
@@ -376,17 +461,36 @@ class mainWindow(QMainWindow):
         if self.inputManager.loc['exp_name'].value == None:
             pass # what to do if user forgets to put in exp name/sample???
             
+        try:
+            self.parameters = MeasurementParameters.fromFrame(self.inputManager) # typed snapshot for the workers
+        except ValueError as error: # eg text in a number field
+            print ('### Invalid input: %s ###'%error)
+            self.updateStatus('Invalid input: %s'%error)
+            return None
         mainWindow.saveState(self)
+        return self.parameters
         
+    @pyqtSlot()
+    def startConductivityRun(self):
+        parameters = self.getInputs()
+        if parameters is not None:
+            self.startConductivity.emit(parameters)
+
+    @pyqtSlot()
+    def startInficonRun(self):
+        self.depositionRun = True
+        try:
+            parameters = self.getInputs()
+        finally:
+            self.depositionRun = False
+        if parameters is not None:
+            self.startInficon.emit(parameters)
         
     @pyqtSlot()
     def saveState(self):
-        ''' Save current inputs to csv '''
+        ''' Save current inputs to csv, in the background '''
         try:
-            hdr =  ' --- Insitu ECHO meas template for data-frame used to store inputs and write file header - change at your own risk---,,,,'
-            with open('src/df_measurement.csv','w') as f:
-                f.write(hdr + '\n')
-            self.inputManager.to_csv('src/df_measurement.csv', mode = 'a', na_rep = ' ') #append (hdr)
+            self.parameters.saveInBackground()
         except:
             print ('Settings NOT saved. Please check df_template status.')
 
@@ -395,6 +499,7 @@ class mainWindow(QMainWindow):
         ''' write inputManager values to user input widgets.
                 input widget values saved on close to inputManager csv'''
         try:
+            import pandas as pd #only needed once inputs are read
             self.inputManager = pd.DataFrame.from_csv('src/df_measurement.csv', header = 1)
             for w in self.inputWidgets:
                 field = w.accessibleName()
@@ -424,6 +529,20 @@ class mainWindow(QMainWindow):
         else:
             print ('### Data has not been saved. ###')    
             
+    @pyqtSlot(object)
+    def saveChipData(self, record):
+        '''Save the merged record of every device on the chip'''
+        if self.mainWindow.checkBoxSave.isChecked():
+            self.inputManager.loc['setup'].value = str('Chip_conductivity')
+            self.inputManager.loc['x_descript'].value = str('OFET_width, OFET_no, Sample')
+            self.inputManager.loc['x_descript'].units = str('')
+            self.inputManager.loc['y_descript'].value = str('Voltage, Current, Conductivity')
+            self.inputManager.loc['y_descript'].units = str('V, A, S/m')
+            from src.multi_smu import CHIP_COLUMNS
+            Utilities.chip_save_to_file(self.inputManager, record, CHIP_COLUMNS)
+        else:
+            print ('### Data has not been saved. ###')
+
     @pyqtSlot(object)
     def saveDepositionData(self, dat):
         '''Save final data array'''
@@ -447,66 +566,82 @@ class mainWindow(QMainWindow):
         
     @pyqtSlot(object)    
     def plotPoint(self, datPoint):
-        '''Update GUI graph with new IV measurement point'''
-        self.fixedVfig.plot(datPoint[0],datPoint[2])
-        self.fixedVfig.figure.suptitle('Fixed Voltage Measurements')
-        self.fixedVfig.axes.set_xlabel('Sample')
-        self.fixedVfig.axes.set_ylabel('I (A)')
-        self.mainWindow.pltWidget.figure.tight_layout()
-        self.mainWindow.pltWidget.draw()
+        '''Update GUI graph with the fixed voltage readings so far (t, v, i)'''
+        self.IVplot.show('Fixed Voltage Measurements', 'Time (s)', 'I (A)')
+        self.IVplot.set('fixedV', datPoint[0], datPoint[2], 'o-')
         
     @pyqtSlot(object)    
     def plotDepositionPoint(self, datPoint):
-        '''Update GUI graph with new deposition measurement point'''
-        if (self.mainWindow.comboBoxQCM_Display.currentText() == 'Thickness'):
-            self.depositionfig.plot(datPoint[0],datPoint[1], 'rs', datPoint[0],datPoint[3], 'bs', datPoint[0],datPoint[5], 'gs', datPoint[0],datPoint[7], 'ys',)
-            self.depositionfig.figure.suptitle('Thickness Monitor')
-            self.depositionfig.axes.set_xlabel('Time (s)')
-            self.depositionfig.axes.set_ylabel('Thickness (Angstroms)')
-            self.mainWindow.pltWidget_2.figure.tight_layout()
-            self.mainWindow.pltWidget_2.draw()
-        if (self.mainWindow.comboBoxQCM_Display.currentText() == 'Rates'):
-            self.depositionfig.plot(datPoint[0],datPoint[2], 'r--', datPoint[0],datPoint[4], 'b--', datPoint[0],datPoint[6], 'g--', datPoint[0],datPoint[8], 'y--',)
-            self.depositionfig.figure.suptitle('Rate Monitor')
-            self.depositionfig.axes.set_xlabel('Time (s)')
-            self.depositionfig.axes.set_ylabel('Rate (Angstroms/sec)')
-            self.mainWindow.pltWidget_2.figure.tight_layout()
-            self.mainWindow.pltWidget_2.draw()        
-        
+        '''Update GUI graph with the new deposition measurement points (only those since the last call)'''
+        for k in range(len(datPoint[0])):
+            self.depositionPoints.append((datPoint[0][k], [datPoint[1 + 2*n][k] for n in range(4)], [datPoint[2 + 2*n][k] for n in range(4)]))
+        points = self.depositionPoints.latest()
+        if self.mainWindow.comboBoxQCM_Display.currentText() == 'Thickness':
+            self.depositionPlot.show('Thickness Monitor', 'Time (s)', 'Thickness (Angstroms)') # new lines if the display changed
+            field, style = 'thickness', 's'
+        else:
+            self.depositionPlot.show('Rate Monitor', 'Time (s)', 'Rate (Angstroms/sec)')
+            field, style = 'rate', '--'
+        for n, colour in enumerate('rbgy'):
+            self.depositionPlot.set('QCM%d'%(n + 1), points['time'], points[field][:, n], colour + style)
+
+    @pyqtSlot()
+    def resetDepositionPlot(self):
+        '''Empty the deposition graph for a new run'''
+        self.depositionPoints = RingBuffer(DEPOSITION_PLOT_RECORD, capacity=DEPOSITION_PLOT_POINTS, spill=False)
+        self.depositionPlot.clear()
         
         
+    @pyqtSlot(object)
+    def plotInsituPoint(self, row):
+        '''Add an in-situ reading to the conductivity against thickness graph'''
+        if self.insituPoints is None:
+            from src.insitu_engine import INSITU_RECORD # already loaded by the worker
+            self.insituPoints = RingBuffer(INSITU_RECORD, capacity=DEPOSITION_PLOT_POINTS, spill=False)
+        self.insituPoints.append(row)
+        points = self.insituPoints.latest()
+        self.IVplot.show('In-situ conductivity', 'Thickness (kAngstroms)', 'Conductivity (S/m)')
+        self.IVplot.set('insitu', points['Thickness'], points['Conductivity'], 'ko')
+
+    @pyqtSlot()
+    def resetInsituPlot(self):
+        '''Empty the in-situ graph for a new run'''
+        self.insituPoints = None # made on the first reading
+
     @pyqtSlot(object)    
     def plotIV(self, datPoint):
-        '''Update GUI graph with new measurement point'''
-        #embeddedGraph = self.mainWindow.pltWidget
-        #self.IVfig = self.mainWindow.pltWidget.figure.add_subplot(111)
-        #embeddedGraph.figure.tight_layout()
-        #self.mainWindow.toolbar = NavigationToolbar(embeddedGraph,self)
-        #self.mainWindow.plotLayout.addWidget(self.mainWindow.toolbar)
-        
-        self.IVfig.plot(datPoint[0],datPoint[1])
-        self.IVfig.figure.suptitle('IV plot')
-        self.IVfig.axes.set_xlabel('Voltage [V]')
-        self.IVfig.axes.set_ylabel('I (A)')
-        self.mainWindow.pltWidget.figure.tight_layout()
-        self.mainWindow.pltWidget.draw()        
+        '''Update GUI graph with a new IV sweep (v, i), the last IV_PLOT_SWEEPS stay'''
+        self.IVplot.show('IV plot', 'Voltage [V]', 'I (A)')
+        self.IVsweeps += 1
+        self.IVplot.set(self.IVsweeps, datPoint[0], datPoint[1], keep=IV_PLOT_SWEEPS)
 
 
+    @pyqtSlot()
     def setUpPlot(self):
-        '''Create matplotlib in main window'''
+        '''Create matplotlib in main window (called once the window is shown)'''
+        if '--startup-time' in sys.argv:
+            print('Window shown after %.2f s'%(time.monotonic() - STARTED))
+        from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as NavigationToolbar
         # Conductivity plot
         embeddedGraph = self.mainWindow.pltWidget
         #self.fixedVfig = embeddedGraph.figure.add_subplot(111)
         self.IVfig = self.mainWindow.pltWidget.figure.add_subplot(111)
+        self.IVplot = LivePlot(embeddedGraph, self.IVfig) # IV, fixed voltage and in-situ graphs
+        self.IVsweeps = 0
         embeddedGraph.figure.tight_layout()
-        self.mainWindow.toolbar = NavigationToolbar(embeddedGraph,self)
+        self.mainWindow.toolbar = NavigationToolbar(embeddedGraph.load(),self)
         self.mainWindow.plotLayout.addWidget(self.mainWindow.toolbar)
         # Deposition Plot
         embeddedGraph2 = self.mainWindow.pltWidget_2
         self.depositionfig = embeddedGraph2.figure.add_subplot(111)
+        self.depositionPlot = LivePlot(embeddedGraph2, self.depositionfig) # QCM thickness or rate
+        self.resetDepositionPlot()
+        self.resetInsituPlot()
         embeddedGraph2.figure.tight_layout()
-        self.mainWindow.toolbar2 = NavigationToolbar(embeddedGraph2,self)
-        self.mainWindow.plotLayout_2.addWidget(self.mainWindow.toolbar2)        
+        self.mainWindow.toolbar2 = NavigationToolbar(embeddedGraph2.load(),self)
+        self.mainWindow.plotLayout_2.addWidget(self.mainWindow.toolbar2)
+        if '--startup-time' in sys.argv:
+            print('Plots ready after %.2f s'%(time.monotonic() - STARTED))        
         
         
 class EmittingStream(QObject):
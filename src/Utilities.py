@@ -1,11 +1,10 @@
-import visa
-import pandas as pd
 import numpy as np
-from PyQt4.QtGui import *
 import os
 import sys
 import glob
-import serial
+import shutil
+import time
+from src import comm_stats
 
 def inst_autoFind(s, rm):
 	''' Find instrument Address from IDN string 
@@ -89,6 +88,7 @@ def save_to_file(inptMgerDf, x, y):
 	f = generate_file_name(inptMgerDf)
 	np.savetxt(f,data, delimiter = '\t', fmt = format, header = hdr, comments = '')
 	print ('Data has been saved locally: ', f)
+	comm_stats.save(f) #instrument timing, if recorded
 	
 	#save to group drive
 	try: 
@@ -114,6 +114,7 @@ def deposition_save_to_file(inptMgerDf, sampletime, QCM1_thickness, QCM1_rate, Q
 	f = generate_file_name(inptMgerDf)
 	np.savetxt(f,data, delimiter = '\t', fmt = format, header = hdr, comments = '')
 	print ('Data has been saved locally: ', f)
+	comm_stats.save(f) #instrument timing, if recorded
 	
 	#save to group drive
 	try: 
@@ -139,6 +140,7 @@ def conductivity_save_to_file(inptMgerDf, sample, voltage, current, conductivity
 	f = generate_file_name(inptMgerDf)
 	np.savetxt(f,data, delimiter = '\t', fmt = format, header = hdr, comments = '')
 	print ('Data has been saved locally: ', f)
+	comm_stats.save(f) #instrument timing, if recorded
 	
 	#save to group drive
 	try: 
@@ -152,8 +154,83 @@ def conductivity_save_to_file(inptMgerDf, sample, voltage, current, conductivity
 		print ('Data has not be saved remotely.')
 
 
+def chip_save_to_file(inptMgerDf, record, columns):
+	''' Save the merged record of several devices, one row per sample'''
+
+	hdr = pandas_2fmfHeader(inptMgerDf)
+	data = np.column_stack([record[c] for c in columns])
+	data = data.astype(float)
+	format = ['%.6g']*data.shape[1]
+
+	#save to user location
+	f = generate_file_name(inptMgerDf)
+	np.savetxt(f,data, delimiter = '\t', fmt = format, header = hdr, comments = '')
+	print ('Data has been saved locally: ', f)
+	comm_stats.save(f) #instrument timing, if recorded
+
+
+class StreamingFMFWriter():
+	''' FMF file written while the data comes in, so a crash loses at most the last few rows.
+		The header is written on opening, rows are appended in batches and synced to disk
+		every syncInterval s, close() finalises the file and copies it to the group drive.
+	'''
+	def __init__(self, inptMgerDf, batch=64, syncInterval=5.0, fmt='%.6g'):
+		self.inptMgerDf = inptMgerDf
+		self.batch = batch
+		self.syncInterval = syncInterval
+		self.fmt = fmt
+		self.rows = []
+		self.path = generate_file_name(inptMgerDf)
+		self.f = open(self.path, 'w')
+		self.f.write(pandas_2fmfHeader(inptMgerDf) + '\n')
+		self.sync()
+		print ('Data is being saved locally: ', self.path)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *error):
+		self.close()
+
+	def append(self, row):
+		''' Add one row (sequence of numbers, None is written as nan)'''
+		self.rows.append('\t'.join(self.fmt%(np.nan if x is None else x) for x in row))
+		if len(self.rows) >= self.batch or time.monotonic() - self.synced > self.syncInterval:
+			self.sync()
+
+	def sync(self):
+		''' Write the buffered rows and make sure they are on disk'''
+		if self.rows:
+			self.f.write('\n'.join(self.rows) + '\n')
+			self.rows = []
+		self.f.flush()
+		os.fsync(self.f.fileno())
+		self.synced = time.monotonic()
+
+	def close(self):
+		''' Write the rest, close the file and copy it to the group drive'''
+		if self.f.closed:
+			return
+		self.sync()
+		self.f.close()
+		print ('Data has been saved locally: ', self.path)
+		comm_stats.save(self.path) #instrument timing, if recorded
+
+		#copy to group drive
+		try: 
+			y_address= '\\dc3.physics.ox.ac.uk\dfs\DAQ\CondensedMatterGroups\MRGroup\Transistor_data\\'
+			y_address+= self.inptMgerDf.loc['exp_name'].value + '\\' + self.inptMgerDf.loc['user'].value + '\\'
+			f = generate_file_name(self.inptMgerDf, y_address)
+			shutil.copyfile(self.path, f)
+			print ('Data has been saved remotely: ', f)
+			
+		except:
+			print ('Data has not be saved remotely.')
+
+
 def getWidgetValue(w):
 	''' Get QWidget values w/o worry of its type'''
+	from PyQt4.QtGui import QLineEdit, QSpinBox, QDoubleSpinBox, QComboBox, QRadioButton, QCheckBox #only needed by the GUI
 	if type(w) == QLineEdit:
 		return str(w.text())
 	elif type(w) == QSpinBox or type(w) == QDoubleSpinBox:
@@ -169,12 +246,14 @@ def getWidgetValue(w):
 
 def setWidgetValue(w, v):
 	'''set QWidget value w/o worry of its type.'''
+	from PyQt4.QtGui import QLineEdit, QSpinBox, QDoubleSpinBox, QComboBox, QRadioButton, QCheckBox #only needed by the GUI
 	if type(w) == QLineEdit:
 		w.setText('%s'%v)
 	elif type(w) == QSpinBox or type(w) == QDoubleSpinBox:
 		w.setValue(float(v))
 	elif type(w) == QComboBox:
-		pass #kind of annoying as these work in index, need to loop until find right index	
+		if w.findText('%s'%v) >= 0: w.setCurrentIndex(w.findText('%s'%v))
+		elif w.isEditable(): w.setEditText('%s'%v)
 	elif type(w) == QRadioButton or type(w) == QCheckBox:
 		if v == 'False': w.setChecked(False)
 		if v == 'True': w.setChecked(True)
@@ -183,6 +262,8 @@ def setWidgetValue(w, v):
 #test
 def testModule():
 	'''test all functions - requires a correct df_template.csv'''
+	import visa
+	import pandas as pd
 
 	rm = visa.ResourceManager()
 	print('inst addresses (visa)', rm.list_resources())
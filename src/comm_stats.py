@@ -0,0 +1,109 @@
+'''
+Optional timing of instrument communication. Drivers record every command when their
+stats attribute is set, the summary shows where the time of a run went.
+'''
+
+import math
+import threading
+import time
+
+BINS_PER_DECADE = 4
+FIRST_BIN = 1e-5 # s, upper edge of the first histogram bin
+N_BINS = 7*BINS_PER_DECADE + 1 # up to 100 s, last bin takes everything slower
+TIMEOUT_CODE = -1073807339 # pyvisa VI_ERROR_TMO
+
+stats = {} # instrument name (with its address): CommStats of the current run
+
+def isTimeout(error):
+    '''True if a driver exception means the instrument did not answer in time'''
+    return isinstance(error, TimeoutError) or getattr(error, 'error_code', None) == TIMEOUT_CODE
+
+def histogramBin(elapsed):
+    if elapsed <= FIRST_BIN:
+        return 0
+    return min(N_BINS - 1, int(math.log10(elapsed/FIRST_BIN)*BINS_PER_DECADE) + 1)
+
+def binEdge(n):
+    '''Upper edge of histogram bin n in s'''
+    return FIRST_BIN*10**(n/BINS_PER_DECADE)
+
+
+class CommStats():
+    '''Wall time, bytes, retries and timeouts per command of one instrument'''
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.commands = {}
+        self.started = time.monotonic()
+
+    def record(self, command, elapsed, nbytes=0, retries=0, timeout=False, skipped=False):
+        '''Add one transaction, skipped ones were answered from a cache without any I/O'''
+        with self.lock:
+            entry = self.commands.get(command)
+            if entry is None:
+                entry = self.commands[command] = {'count': 0, 'time': 0.0, 'max': 0.0, 'bytes': 0,
+                    'retries': 0, 'timeouts': 0, 'skipped': 0, 'histogram': [0]*N_BINS}
+            if skipped:
+                entry['skipped'] += 1
+                return
+            entry['count'] += 1
+            entry['time'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['bytes'] += nbytes
+            entry['retries'] += retries
+            entry['timeouts'] += int(timeout)
+            entry['histogram'][histogramBin(elapsed)] += 1
+
+    def summary(self):
+        '''Table of the commands sorted by total time, with a latency histogram'''
+        with self.lock:
+            commands = sorted(self.commands.items(), key=lambda item: -item[1]['time'])
+            wall = time.monotonic() - self.started
+            busy = sum(entry['time'] for _, entry in commands)
+            lines = ['%s communication: %.3f s of %.3f s run (%.0f%%)'%(self.name, busy, wall, 100*busy/wall if wall else 0)]
+            lines.append('Command\tCount\tTotal [s]\tMean [ms]\tMax [ms]\tBytes\tRetries\tTimeouts\tSkipped')
+            histogram = [0]*N_BINS
+            for command, entry in commands:
+                mean = 1e3*entry['time']/entry['count'] if entry['count'] else 0
+                lines.append('%s\t%d\t%.4f\t%.3f\t%.3f\t%d\t%d\t%d\t%d'%(command, entry['count'], entry['time'],
+                    mean, 1e3*entry['max'], entry['bytes'], entry['retries'], entry['timeouts'], entry['skipped']))
+                histogram = [a + b for a, b in zip(histogram, entry['histogram'])]
+            lines.append('Latency [ms]\tCount')
+            for n, count in enumerate(histogram):
+                if count:
+                    lines.append('<%.3g\t%d'%(1e3*binEdge(n), count))
+        return '\n'.join(lines)
+
+
+def newRun():
+    '''Forget the statistics of earlier runs, called when a run starts'''
+    stats.clear()
+
+def start(name):
+    '''Statistics for instrument name in this run, to be set as the driver's stats attribute.
+    Later calls in the same run (eg the next device of a chip) add to them'''
+    if name not in stats:
+        stats[name] = CommStats(name)
+    return stats[name]
+
+def stop(name):
+    '''No statistics for instrument name in this run'''
+    stats.pop(name, None)
+    return None
+
+def summary():
+    '''Summary of every instrument recorded in this run'''
+    return '\n\n'.join(s.summary() for s in stats.values())
+
+def save(dataFile):
+    '''Write the summary next to dataFile, if anything was recorded'''
+    if not stats:
+        return
+    path = dataFile.rsplit('.', 1)[0] + '_comm.txt'
+    with open(path, 'w') as f:
+        f.write(summary() + '\n')
+    print('Communication statistics saved: ', path)
@@ -0,0 +1,37 @@
+'''
+Qt free stand-ins for the worker objects the engines run on. The engines only call
+emit on the worker's signals and check its _flag, so any object with those works.
+'''
+
+class Signal():
+    '''Replacement for pyqtSignal: emit calls every connected callback in the emitting thread'''
+
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+
+class EngineWorker():
+    '''Plain object with the signals, parameters and stop flag the engines expect of a worker'''
+
+    SIGNALS = ('signalStatus', 'progressBar', 'IVConsole', 'ConductivityConsole', 'KeithleyConsole',
+               'InficonConsole', 'newIVData', 'endIVData', 'endCondData', 'newfixedVDataPoint',
+               'endData', 'newDepositionDataPoint', 'endDepositionData', 'newInsituDataPoint')
+
+    def __init__(self, user_parameters=None):
+        self._flag = False
+        self.user_parameters = user_parameters
+        self.executor = None # MultiSMUExecutor of a chip run, aborted by stopWork
+        for name in EngineWorker.SIGNALS:
+            setattr(self, name, Signal())
+
+    def stopWork(self):
+        self._flag = True
+        if self.executor is not None:
+            self.executor.abort()
@@ -0,0 +1,251 @@
+'''
+Measurements without the GUI. A recipe file gives parameter values and a list of steps,
+each step runs one engine on a plain EngineWorker (src.events), data go to disk as in the GUI
+and progress is printed on stdout. Recipes are TOML, or YAML if PyYAML is installed:
+
+    python3 -m src.headless recipe.toml [--simulate] [--parameters src/df_measurement.csv]
+
+    [parameters]               # changes to the parameter file, keys as in df_template.csv
+    exp_name = "batch"
+    sav_loc = "/data/batch"
+    OFET_thickness = 40
+
+    [[steps]]
+    measure = "conductivity"   # ivsweep, fixedv, conductivity, chip, deposition or insitu
+    OFET_width = 20            # any other key changes a parameter for this step only
+    OFET_no = 1
+
+    [[steps]]
+    measure = "deposition"
+    duration = 600             # s, stop after this long (otherwise at QCM_target or Ctrl-C)
+
+--simulate uses the simulated Keithley and Inficon, eg for unattended tests.
+'''
+
+import datetime
+import getpass
+import sys
+import threading
+import time
+
+import src.comm_stats as comm_stats
+from src.events import EngineWorker
+from src.parameters import MeasurementParameters
+
+MEASUREMENTS = { # measure: parameter changes made for it, as getInputs does in the GUI
+    'ivsweep': {'setup': 'IVsweep', 'takeIVsweep': True, 'takefixedV': False},
+    'fixedv': {'setup': 'FixedV', 'takeIVsweep': False, 'takefixedV': True,
+               'x_descript': 'Time', 'y_descript': 'Voltage, Current'},
+    'conductivity': {'setup': 'Conductivity'},
+    'chip': {'setup': 'Chip_conductivity', 'x_descript': 'OFET_width, OFET_no, Sample',
+             'y_descript': 'Voltage, Current, Conductivity'},
+    'deposition': {'setup': 'DepositionMonitoring', 'insitu': False, 'x_descript': 'Time',
+                   'y_descript': 'QCM1 thickness, QCM1 rate, QCM2 thickness, QCM2 rate, etc.'},
+    'insitu': {'setup': 'InsituConductivity', 'insitu': True, 'x_descript': 'Time',
+               'y_descript': 'Thickness, Rate, Voltage, Current, Conductivity'},
+}
+UNITS = { # measure: units of the changed data descriptions, in the '/unit' form of df_template.csv
+    'fixedv': {'x_descript': '/s', 'y_descript': '/(V, A)'},
+    'chip': {'x_descript': '', 'y_descript': '/(V, A, S/m)'},
+    'deposition': {'x_descript': '/s', 'y_descript': ''},
+    'insitu': {'x_descript': '/s', 'y_descript': '/(kA, A/s, V, A, S/m)'},
+}
+STEP_KEYS = ('measure', 'duration') # step entries that are not parameters
+SIMULATED = {'connectionType': 'Simulated', 'QCM_port': 'Simulated'}
+
+def load_recipe(path):
+    '''The recipe in path as a dict with 'parameters' (dict) and 'steps' (list of dicts)'''
+    if path.endswith(('.yaml', '.yml')):
+        import yaml #only needed for YAML recipes
+        with open(path) as f:
+            recipe = yaml.safe_load(f) or {}
+    else:
+        try:
+            import tomllib
+        except ImportError: # python < 3.11
+            import tomli as tomllib
+        with open(path, 'rb') as f:
+            recipe = tomllib.load(f)
+    recipe.setdefault('parameters', {})
+    steps = recipe.get('steps')
+    if not steps:
+        raise ValueError('%s has no steps'%path)
+    for n, step in enumerate(steps):
+        if step.get('measure') not in MEASUREMENTS:
+            raise ValueError('Step %d: measure must be one of %s'%(n + 1, ', '.join(MEASUREMENTS)))
+    return recipe
+
+def step_parameters(base, step):
+    '''Parameters of one step: base with the step's changes and the ones its measurement needs'''
+    changes = dict(MEASUREMENTS[step['measure']])
+    changes.update((key, value) for key, value in step.items() if key not in STEP_KEYS)
+    changes.update({'date': str(datetime.datetime.now()), 'user': str(getpass.getuser()), 'vers': 'headless'})
+    return base.replace(changes, UNITS.get(step['measure'], {}))
+
+
+class Progress():
+    '''Prints what a worker reports, data points at most every interval s'''
+
+    def __init__(self, prefix, interval=1.0):
+        self.prefix = prefix
+        self.interval = interval
+        self.printed = 0 # monotonic time of the last data line
+        self.percent = None
+
+    def message(self, *parts):
+        print('%s %s'%(self.prefix, ' '.join(str(part) for part in parts)), flush=True)
+
+    def progress(self, percent):
+        if self.percent is None or int(percent) != int(self.percent):
+            self.percent = percent
+            self.message('%d%%'%percent)
+
+    def point(self, text):
+        if time.monotonic() - self.printed >= self.interval:
+            self.printed = time.monotonic()
+            self.message(text)
+
+    def connect(self, worker):
+        for name in ('signalStatus', 'IVConsole', 'ConductivityConsole', 'KeithleyConsole', 'InficonConsole'):
+            getattr(worker, name).connect(self.message)
+        worker.progressBar.connect(self.progress)
+        worker.newfixedVDataPoint.connect(lambda data: self.point('t %.3g s  V %.4g  I %.4g'%(data[0][-1], data[1][-1], data[2][-1])))
+        worker.newDepositionDataPoint.connect(lambda columns: self.point('t %.1f s  '%columns[0][-1] +
+            '  '.join('QCM%d %.4g kA %.3g A/s'%(n + 1, columns[1 + 2*n][-1], columns[2 + 2*n][-1]) for n in range(4))))
+        worker.newInsituDataPoint.connect(lambda row: self.point('t %.1f s  %.4g kA  %.4g A  %.3g S/m'%(row[0], row[1], row[4], row[5])))
+
+
+class FixedVStream():
+    '''Appends the new fixed voltage readings to a StreamingFMFWriter as they are reported'''
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.written = 0
+
+    def __call__(self, data):
+        t, v, i = data
+        for n in range(self.written, len(i)):
+            self.writer.append((t[n], v[n], i[n]))
+        self.written = len(i)
+
+
+def run_step(worker, measure):
+    '''The engine calls the GUI worker would make for measure (on this thread)'''
+    import src.Utilities as Utilities
+    pars = worker.user_parameters
+    save = pars.value['saveData']
+    comm_stats.newRun() # only this step's instruments in the summary
+    if measure in ('ivsweep', 'fixedv'):
+        from src.measurement_engine import IV_Engine
+        smu, rm = IV_Engine.connect2Keith(worker)
+        if measure == 'ivsweep':
+            if save:
+                worker.endData.connect(lambda data: Utilities.save_to_file(pars.frame(), data[0], data[1]))
+            IV_Engine.measure_IVsweep(worker, smu)
+        elif save:
+            with Utilities.StreamingFMFWriter(pars.frame()) as writer:
+                worker.newfixedVDataPoint.connect(FixedVStream(writer))
+                IV_Engine.measure_fixedV(worker, smu)
+        else:
+            IV_Engine.measure_fixedV(worker, smu)
+    elif measure == 'conductivity':
+        from src.measurement_engine import Conductivity_Engine
+        if save:
+            sweep = pars.replace({'setup': 'IV_sweep'}).frame()
+            worker.endIVData.connect(lambda data: Utilities.save_to_file(sweep, data[0], data[1]))
+            worker.endCondData.connect(lambda data: Utilities.conductivity_save_to_file(pars.frame(), *data))
+        smu, rm = Conductivity_Engine.connect2Keith(worker)
+        Conductivity_Engine.measure(worker, smu)
+    elif measure == 'chip':
+        import src.multi_smu as multi_smu
+        executor = worker.executor = multi_smu.MultiSMUExecutor.fromParameters(pars) # stopWork aborts it
+        def newResult(name, kind, data):
+            if kind in ('console', 'error'):
+                worker.ConductivityConsole.emit('%s: %s'%(name, data))
+            elif kind == 'conductivity':
+                worker.progressBar.emit(100*len([r for r in executor.results.values() if 'conductivity' in r])/len(executor.names))
+        record = executor.run(newResult) # saves each device's files as it goes if saveData
+        for name, samples, mean, std in executor.summary():
+            worker.ConductivityConsole.emit('%s: %d samples, %.3e +- %.1e S/cm'%(name, samples, mean*1e-2, std*1e-2))
+        if save:
+            Utilities.chip_save_to_file(pars.frame(), record, multi_smu.CHIP_COLUMNS)
+    elif measure == 'deposition':
+        from src.inficon_engine import inficon_engine
+        inficon_engine.monitor_QCM(worker) # streams to file itself
+    elif measure == 'insitu':
+        from src.insitu_engine import insitu_engine
+        insitu_engine.monitor(worker) # streams to file itself
+
+def run_recipe(recipe, base, interval=1.0):
+    '''Run the steps of recipe one after another. Returns the number of steps that failed;
+    Ctrl-C stops the current step and skips the rest'''
+    base = base.replace(recipe['parameters'])
+    steps = recipe['steps']
+    failed = 0
+    try:
+        for n, step in enumerate(steps):
+            pars = step_parameters(base, step)
+            label = step['measure']
+            if pars.value['OFET_width'] is not None and step['measure'] in ('ivsweep', 'fixedv', 'conductivity', 'insitu'):
+                label += ' OFET_%s_%s'%(pars.value['OFET_width'], pars.value['OFET_no'])
+            progress = Progress('[%d/%d %s]'%(n + 1, len(steps), label), interval)
+            worker = EngineWorker(pars)
+            progress.connect(worker)
+            errors = []
+            def target():
+                try:
+                    run_step(worker, step['measure'])
+                except Exception as error:
+                    errors.append(error)
+            thread = threading.Thread(target=target, name='Step %d'%(n + 1))
+            started = time.monotonic()
+            thread.start()
+            try:
+                while thread.is_alive():
+                    thread.join(0.1)
+                    if 'duration' in step and time.monotonic() - started >= float(step['duration']) and not worker._flag:
+                        progress.message('Duration reached, stopping')
+                        worker.stopWork()
+            except KeyboardInterrupt:
+                progress.message('Interrupted, stopping')
+                worker.stopWork()
+                thread.join()
+                raise
+            if errors:
+                failed += 1
+                progress.message('### Step failed: %s ###'%errors[0])
+            else:
+                progress.message('Done in %.1f s'%(time.monotonic() - started))
+    finally:
+        if 'src.k2400_control' in sys.modules: # only if a Keithley was used
+            sys.modules['src.k2400_control'].smuSessions.closeAll() # release the Keithley connections
+    return failed
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python3 -m src.headless', description='Run a measurement recipe without the GUI')
+    parser.add_argument('recipe', help='TOML or YAML recipe file')
+    parser.add_argument('--parameters', default='src/df_measurement.csv', help='parameter file the recipe changes (default: the last GUI settings)')
+    parser.add_argument('--simulate', action='store_true', help='simulated Keithley and Inficon')
+    parser.add_argument('--interval', type=float, default=1.0, help='s between printed data points')
+    args = parser.parse_args(args)
+    try:
+        recipe = load_recipe(args.recipe)
+        base = MeasurementParameters.fromCSV(args.parameters)
+        for step in recipe['steps']:
+            step_parameters(base.replace(recipe['parameters']), step) # text where a number belongs
+    except Exception as error: # missing file, bad syntax, no TOML/YAML parser, invalid value
+        print('### Recipe not run: %s ###'%error)
+        return 2
+    if args.simulate:
+        base = base.replace(SIMULATED)
+    try:
+        failed = run_recipe(recipe, base, args.interval)
+    except KeyboardInterrupt:
+        print('### Recipe interrupted ###')
+        return 130
+    print('%d of %d steps completed'%(len(recipe['steps']) - failed, len(recipe['steps'])))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,14 +5,64 @@ Code adapted from https://github.com/CINF/PyExpLabSys/blob/master/PyExpLabSys/dr
 
 import serial
 import time
+import timeit
+import numpy as np
+
+CRC_INIT = 0x3fff
+CRC_MASK = 0x2001
+
+def _crc_table():
+    '''CRC of every single byte value after eight shifts, as crc_calc_reference does per byte'''
+    table = []
+    for byte in range(256):
+        crc = byte
+        for i in range(8):
+            crc = (crc >> 1) ^ CRC_MASK if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+CRC_TABLE = _crc_table()
+
+def crc_bytes(data):
+    """ Two crc bytes of data (bytes or bytearray), one table lookup per byte """
+    crc = CRC_INIT
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+    return bytes(((crc & 0x7f) + 34, (crc >> 7) + 34))
+
+def benchmark_crc(n=10000):
+    """ Time crc_calc (table) against crc_calc_reference (bit loop) on a typical reply """
+    reply = '$' + 'A 0.1234 56.789 5987654.321'
+    assert inficon310C.crc_calc(reply) == inficon310C.crc_calc_reference(reply)
+    data = reply.encode('cp437')
+    results = {}
+    for name, f, arg in (('reference', inficon310C.crc_calc_reference, reply), ('table', inficon310C.crc_calc, reply),
+                         ('bytes', crc_bytes, data)):
+        results[name] = timeit.timeit(lambda: f(arg), number=n)/n
+        print('%s\t%.2f us'%(name, 1e6*results[name]))
+    return results
+
+CHANNELS = 4
+QCM_RECORD = np.dtype([('time', 'f8'), ('thickness', 'f8', CHANNELS), ('rate', 'f8', CHANNELS),
+                       ('frequency', 'f8', CHANNELS), ('life', 'f8', CHANNELS)]) # NaN for channels not read
+
+class InficonError(Exception):
+    """ No valid reply from the controller """
+
+class InficonTimeout(InficonError):
+    """ The reply frame did not arrive in time """
+
+class InficonCRCError(InficonError):
+    """ A complete frame arrived but its crc does not match """
 
 class inficon310C(object):
     """ Driver for Inficon SQM160 QCM controller """
-    def __init__(self, port='/dev/ttyUSB0'):
+    def __init__(self, port='/dev/ttyUSB0', timeout=2, retries=5):
         # This command opens the serial port
         self.serial = serial.Serial(port=port,
                                     baudrate=115200,
-                                    timeout=2,
+                                    timeout=timeout,
                                     bytesize=serial.EIGHTBITS,
                                     xonxoff=True)
         
@@ -33,37 +83,146 @@ class inficon310C(object):
         #SerialException – In case the device can not be found or can not be configured.        
        
         print (self.serial.name) # Check which port was really used
+        self.stats = None # comm_stats.CommStats recording every command, None to disable
+        self.timeout = timeout # s to wait for a reply frame
+        self.retries = retries # attempts after a timeout or crc error
+        self.timeouts = 0 # replies that did not arrive, since connecting
+        self.crcErrors = 0 # replies that failed the crc check, since connecting
+        self.pipelined = True # several commands per write (comm_many), one by one otherwise
 
     def comm(self, command):
-        """ Implements actual communication with device """
+        """ Implements actual communication with device, returns the reply after the status byte
+        or None if no valid reply came after all retries """
         length = chr(len(command) + 34)       
         crc = self.crc_calc(length + command)
         command = '!' + length + command + crc[0] + crc[1]
-        command_bytes = bytearray()
-        for i in range(0, len(command)):
-            command_bytes.append(ord(command[i]))
-        error = 0
-        while (error > -1) and (error < 20):
+        command_bytes = command.encode('latin-1')
+        start = time.perf_counter() if self.stats is not None else 0
+        nbytes = 0
+        for attempt in range(self.retries + 1):
+            self.serial.flushInput() # drop what is left of an earlier bad frame
             self.serial.write(command_bytes) # sends command to instrument in byte type
-            time.sleep(0.1) # Give it a second (or a tenth of one)
-            reply = self.serial.read(self.serial.inWaiting()) # Reads number of bytes in recieved input buffer
-            reply_chr = reply.decode('cp437') # Convert to string as serial for python 3 reads back bytes (?) utf-8 fucks up.
-            crc = self.crc_calc(reply_chr[1:-2]) # make crc error check?
+            nbytes += len(command_bytes)
             try:
-                crc_ok = (reply[-2] == ord(crc[0]) and reply[-1] == ord(crc[1]))
-            except IndexError:
-                crc_ok = False
-            if crc_ok:
-                error = -1
-                return_val = reply[3:-2]
-                return return_val
-            else:
-                error = error + 1
+                reply = self.read_frame()
+            except InficonTimeout as error:
+                nbytes += len(error.args[1]) if len(error.args) > 1 else 0
+                self.timeouts += 1
+                continue
+            except InficonCRCError as error:
+                nbytes += len(error.args[1])
+                self.crcErrors += 1
+                continue
+            nbytes += len(reply)
+            if self.stats is not None:
+                self.stats.record(command[2:-2], time.perf_counter() - start, nbytes, retries=attempt)
+            return reply[3:-2]
+        print('### No valid reply to Inficon command %s (%d timeouts, %d crc errors so far) ###'%(command[2:-2], self.timeouts, self.crcErrors))
+        if self.stats is not None:
+            self.stats.record(command[2:-2], time.perf_counter() - start, nbytes, retries=self.retries, timeout=True)
         return 
 
-    @staticmethod # This means the method can be called without an instance of the class
+    def comm_many(self, commands):
+        """ Send several commands in one write and read their replies in order, one frame after
+        the other. Commands whose reply is lost are repeated one by one with comm. A controller
+        that drops pipelined frames is only asked one command at a time from then on """
+        if not self.pipelined:
+            return [self.comm(command) for command in commands]
+        frames = []
+        for command in commands:
+            length = chr(len(command) + 34)
+            crc = self.crc_calc(length + command)
+            frames.append('!' + length + command + crc[0] + crc[1])
+        command_bytes = ''.join(frames).encode('latin-1')
+        start = time.perf_counter() if self.stats is not None else 0
+        self.serial.flushInput()
+        self.serial.write(command_bytes)
+        nbytes = len(command_bytes)
+        replies = [None]*len(commands)
+        for n in range(len(commands)):
+            try:
+                reply = self.read_frame()
+            except InficonTimeout: # the rest of the pipeline is out of step
+                self.timeouts += 1
+                print('### Inficon pipelining failed, sending commands one by one ###')
+                self.pipelined = False
+                break
+            except InficonCRCError as error:
+                self.crcErrors += 1
+                if len(error.args[1]) < 4: # bad length byte, frame boundaries lost
+                    break
+                continue # a whole frame was read, the next one is still in step
+            nbytes += len(reply)
+            replies[n] = reply[3:-2]
+        if self.stats is not None:
+            self.stats.record(' '.join(commands), time.perf_counter() - start, nbytes,
+                              timeout=None in replies)
+        for n, command in enumerate(commands):
+            if replies[n] is None:
+                replies[n] = self.comm(command)
+        return replies
+
+    def read_channels(self, channels=(1, 2, 3, 4)):
+        """ Thickness, rate, frequency and crystal life of the channels as a QCM_RECORD.
+        The controller has no all-channel query, so the N, L and PA commands of every channel
+        go out in a single write (see comm_many) """
+        commands = []
+        for channel in channels:
+            commands += ['N%d'%channel, 'L%d'%channel, 'PA%d'%channel]
+        record = np.zeros((), dtype=QCM_RECORD)
+        for field in ('thickness', 'rate', 'frequency', 'life'):
+            record[field] = np.nan
+        record['time'] = time.monotonic()
+        replies = self.comm_many(commands)
+        for n, channel in enumerate(channels):
+            thickness, rate, crystal = replies[3*n:3*n + 3]
+            try:
+                record['thickness'][channel - 1] = float(thickness)
+                record['rate'][channel - 1] = float(rate)
+                if crystal is None: # no crystal reply, frequency and life stay NaN
+                    continue
+                status, frequency, life = crystal.decode().split(' ')
+                record['frequency'][channel - 1] = float(frequency)
+                record['life'][channel - 1] = float(life)
+            except (TypeError, ValueError): # no reply or a garbled one, the rest stays NaN
+                pass
+        return record
+
+    def read_frame(self):
+        """ Read one reply frame: sync character, length byte, payload and two crc bytes.
+        Returns as soon as the frame is complete """
+        deadline = time.monotonic() + self.timeout
+        while True: # skip anything before the sync character
+            sync = self.serial.read(1)
+            if not sync or time.monotonic() > deadline:
+                raise InficonTimeout('no reply frame')
+            if sync == b'!':
+                break
+        length = self.serial.read(1)
+        if not length:
+            raise InficonTimeout('no length byte')
+        n = length[0] - 34
+        if n < 0:
+            raise InficonCRCError('invalid length byte', sync + length)
+        rest = self.serial.read(n + 2)
+        frame = sync + length + rest
+        if len(rest) < n + 2:
+            raise InficonTimeout('incomplete frame', frame)
+        if crc_bytes(frame[1:-2]) != frame[-2:]:
+            raise InficonCRCError('crc mismatch', frame)
+        return frame
+
+    @staticmethod
     def crc_calc(input_string):
-        """ Calculate crc value of command """
+        """ Calculate crc value of command, same result as crc_calc_reference """
+        if isinstance(input_string, str):
+            input_string = input_string.encode('latin-1')
+        crc = crc_bytes(input_string)
+        return (chr(crc[0]), chr(crc[1]))
+
+    @staticmethod # This means the method can be called without an instance of the class
+    def crc_calc_reference(input_string):
+        """ Calculate crc value of command bit by bit, kept to check crc_calc against """
         command_string = []
         for i in range(0, len(input_string)):
             command_string.append(ord(input_string[i])) # Input string is already in ordinal format. This is silly
@@ -126,6 +285,10 @@ class inficon310C(object):
         return status, frequency,life
 
 if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ['crc']: # python3 -m src.inficon_control crc
+        benchmark_crc()
+        sys.exit()
     INFICON = inficon310C()
     
     # Test driver functionality
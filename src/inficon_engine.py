@@ -3,9 +3,89 @@ Methods and classes used for controlling the inficon. Driver in separate file.
 '''
 
 from src.inficon_control import *
+import src.comm_stats as comm_stats
+from src.ring_buffer import RingBuffer
+from src.scheduler import DeadlineClock
 import numpy as np
 import time
 
+SAMPLES_IN_MEMORY = 4096 # QCM samples kept in memory, the rest of the run is on disk
+
+def deposition_columns(records):
+    '''QCM_RECORD array as (time, QCM1 thickness, QCM1 rate, ..., QCM4 rate) columns, the
+    layout of newDepositionDataPoint, endDepositionData and deposition_save_to_file'''
+    columns = [records['time']]
+    for n in range(CHANNELS):
+        columns += [records['thickness'][:, n], records['rate'][:, n]]
+    return tuple(columns)
+
+def parse_targets(value):
+    '''QCM_target as a target thickness per channel (None for no target). One number applies
+    to every channel, a comma separated list gives channels 1, 2, ... in turn'''
+    values = [v.strip() for v in str(value).split(',')]
+    values = [None if v in ('', 'nan', 'NA', 'None') else float(v) for v in values]
+    if len(values) == 1:
+        values = values*CHANNELS
+    return (values + [None]*CHANNELS)[:CHANNELS]
+
+
+class ThicknessPredictor():
+    '''Least squares line through thickness against time with exponentially decaying weights
+    (memory of about window samples), updated in O(1) per sample. Predicts when the channel
+    reaches target, falling back to the live rate until two samples are in.'''
+
+    def __init__(self, target, window=20):
+        self.target = target
+        self.decay = 1 - 1/float(window)
+        self.t0 = None # times relative to the first sample keep the sums well conditioned
+        self.w = self.wt = self.wx = self.wtt = self.wtx = 0.0
+        self.samples = 0
+        self.thickness = None
+        self.liveRate = None # kA/s from the controller
+
+    def add(self, t, thickness, rate=None):
+        if np.isnan(thickness):
+            return
+        if self.t0 is None:
+            self.t0 = t
+        t = t - self.t0
+        d = self.decay
+        self.w = d*self.w + 1
+        self.wt = d*self.wt + t
+        self.wx = d*self.wx + thickness
+        self.wtt = d*self.wtt + t*t
+        self.wtx = d*self.wtx + t*thickness
+        self.samples += 1
+        self.thickness = thickness
+        self.t = t
+        if rate is not None and not np.isnan(rate):
+            self.liveRate = rate*1e-3 # controller rate is A/s, thickness kA
+
+    def rate(self):
+        '''Fitted growth rate in thickness units per s'''
+        denominator = self.w*self.wtt - self.wt**2
+        if self.samples < 2 or denominator <= 1e-12*self.w*self.wtt:
+            return self.liveRate
+        return (self.w*self.wtx - self.wt*self.wx)/denominator
+
+    def reached(self):
+        return self.target is not None and self.thickness is not None and self.thickness >= self.target
+
+    def remaining(self):
+        '''Predicted s until the target, None without a target or growth'''
+        if self.target is None or self.thickness is None:
+            return None
+        if self.reached():
+            return 0.0
+        rate = self.rate()
+        if not rate or rate <= 0:
+            return None
+        if self.samples < 2:
+            return (self.target - self.thickness)/rate
+        intercept = (self.wx - rate*self.wt)/self.w
+        return max(0.0, (self.target - intercept)/rate - self.t)
+
+
 class inficon_engine():
     """
     Engine for measurment loops and interfacing the GUI
@@ -15,78 +95,99 @@ class inficon_engine():
         """Things that go first"""
         pass
         
+    def connect(self):
+        '''Open the controller on QCM_port, a simulation is started for QCM_port Simulated'''
+        port = str(self.user_parameters.value['QCM_port'])
+        self.inficonSim = None
+        if port == 'Simulated':
+            from src.inficon_sim import SimulatedInficon #only needed without hardware
+            self.inficonSim = SimulatedInficon().start()
+            port = self.inficonSim.port
+        self.inficon = inficon310C(port=port)
+        name = 'Inficon %s'%self.user_parameters.value['QCM_port']
+        self.inficon.stats = comm_stats.start(name) if self.user_parameters.value['commStats'] else comm_stats.stop(name)
+        return self.inficon
+
+    def disconnect(self):
+        '''Report lost replies and close the controller (and simulation)'''
+        if self.inficon.timeouts or self.inficon.crcErrors:
+            self.InficonConsole.emit('Inficon replies lost: %d timeouts, %d crc errors'%(self.inficon.timeouts, self.inficon.crcErrors))
+        self.inficon.serial.close()
+        if self.inficonSim is not None:
+            self.inficonSim.stop()
+
     def monitor_QCM(self):
         '''Continously probes thickness and rates of selected channels until cancel button is clicked'''
         
-        self.inficon = inficon310C()
-        self.InficonConsole.emit('Monitoring film thickness...')
-        self.signalStatus.emit('Monitoring film thickness...')
-        QCM1_thickness = []
-        QCM1_rate = []
-        QCM2_thickness = []
-        QCM2_rate = []
-        QCM3_thickness = []
-        QCM3_rate = []
-        QCM4_thickness = []
-        QCM4_rate = []
-        data = []
-        sampletime = []
-        samplenumber = 0
+        inficon_engine.connect(self)
+        writer = None
+        save = False
+        try:
+            self.InficonConsole.emit('Monitoring film thickness...')
+            self.signalStatus.emit('Monitoring film thickness...')
+            if self.user_parameters.value['saveData']:
+                try:
+                    import src.Utilities as Utilities #only needed when saving
+                    writer = Utilities.StreamingFMFWriter(self.user_parameters.frame()) # rows on disk as they come in
+                except Exception as error:
+                    print('### Deposition data can not be streamed to file: %s ###'%error)
+            save = self.user_parameters.value['saveData'] and writer is None # saved at the end if streaming failed
+            self.QCM_samples = RingBuffer(QCM_RECORD, capacity=SAMPLES_IN_MEMORY, spill=save) # older samples spill to disk
         
-        if (self.user_parameters.value['QCM1'] == 'True'): 
-            self.InficonConsole.emit('Monitoring Channel 1: <Red>')
-        if (self.user_parameters.value['QCM2'] == 'True'): 
-            self.InficonConsole.emit('Monitoring Channel 2: <Blue>')            
-        if (self.user_parameters.value['QCM3'] == 'True'): 
-            self.InficonConsole.emit('Monitoring Channel 3: <Green>')    
-        if (self.user_parameters.value['QCM4'] == 'True'): 
-            self.InficonConsole.emit('Monitoring Channel 4: <Yellow>')  
+            if self.user_parameters.value['QCM1']:
+                self.InficonConsole.emit('Monitoring Channel 1: <Red>')
+            if self.user_parameters.value['QCM2']:
+                self.InficonConsole.emit('Monitoring Channel 2: <Blue>')            
+            if self.user_parameters.value['QCM3']:
+                self.InficonConsole.emit('Monitoring Channel 3: <Green>')    
+            if self.user_parameters.value['QCM4']:
+                self.InficonConsole.emit('Monitoring Channel 4: <Yellow>')  
         
-        # Measurement loop
-        while self._flag == False:
-            if (self.user_parameters.value['QCM1'] == 'True'):
-                QCM1_thickness1 = self.inficon.thickness(channel=1)
-                QCM1_rate1 = self.inficon.rate(channel=1)
-                QCM1_thickness.append(float(QCM1_thickness1))
-                QCM1_rate.append(float(QCM1_rate1))
-            if (self.user_parameters.value['QCM1'] == 'False'):
-                QCM1_thickness.append(None)
-                QCM1_rate.append(None)
-            if (self.user_parameters.value['QCM2'] == 'True'):
-                QCM2_thickness1 = self.inficon.thickness(channel=2)
-                QCM2_thickness.append(float(QCM2_thickness1))
-                QCM2_rate1 = self.inficon.rate(channel=2)
-                QCM2_rate.append(float(QCM2_rate1))  
-            if (self.user_parameters.value['QCM2'] == 'False'):
-                QCM2_thickness.append(None)
-                QCM2_rate.append(None)             
-            if (self.user_parameters.value['QCM3'] == 'True'):
-                QCM3_thickness1 = self.inficon.thickness(channel=3)
-                QCM3_thickness.append(float(QCM3_thickness1))
-                QCM3_rate1 = self.inficon.rate(channel=3)
-                QCM3_rate.append(float(QCM3_rate1))  
-            if (self.user_parameters.value['QCM3'] == 'False'):
-                QCM3_thickness.append(None)
-                QCM3_rate.append(None)              
-            if (self.user_parameters.value['QCM4'] == 'True'):
-                QCM4_thickness1 = self.inficon.thickness(channel=4)
-                QCM4_thickness.append(float(QCM2_thickness1))
-                QCM4_rate1 = self.inficon.rate(channel=4)
-                QCM4_rate.append(float(QCM4_rate1))  
-            if (self.user_parameters.value['QCM4'] == 'False'):
-                QCM4_thickness.append(None)
-                QCM4_rate.append(None)                
-
-            elif(self.user_parameters.value['QCM1'] == 'False' and self.user_parameters.value['QCM2'] == 'False' and self.user_parameters.value['QCM3'] == 'False' and self.user_parameters.value['QCM4'] == 'False'):
+            channels = [n for n in range(1, 5) if self.user_parameters.value['QCM%d'%n]]
+            if not channels:
                 self.InficonConsole.emit(str('NO QCM CHANNEL SELECTED'))
                 self._flag = True
 
-            sampletime.append(samplenumber*float(self.user_parameters.value['QCM_sampleTime']))
-            data = sampletime, QCM1_thickness, QCM1_rate, QCM2_thickness, QCM2_rate, QCM3_thickness, QCM3_rate, QCM4_thickness, QCM4_rate
-            self.newDepositionDataPoint.emit(data) # for live update 
-            time.sleep(float(self.user_parameters.value['QCM_sampleTime']))
-            samplenumber += 1
-        
-        self.endDepositionData.emit(data)
+            targets = parse_targets(self.user_parameters.value['QCM_target'])
+            predictors = dict((n, ThicknessPredictor(targets[n - 1])) for n in channels if targets[n - 1] is not None)
+            warning = self.user_parameters.value['QCM_targetWarning']
+            warned = set()
+            for n, predictor in predictors.items():
+                self.InficonConsole.emit('Channel %d stops at %g kA'%(n, predictor.target))
+
+            # Measurement loop
+            clock = DeadlineClock(self.user_parameters.value['QCM_sampleTime'], lambda: self._flag).start()
+            while self._flag == False:
+                sampletime, record = clock.stamp(lambda: self.inficon.read_channels(channels)) # all channels in one transaction
+                record['time'] = sampletime
+                self.QCM_samples.append(record)
+                columns = deposition_columns(self.QCM_samples.latest(1))
+                self.newDepositionDataPoint.emit(columns) # only the new sample
+                if writer is not None:
+                    writer.append([column[0] for column in columns])
+                for n, predictor in predictors.items():
+                    predictor.add(sampletime, record['thickness'][n - 1], record['rate'][n - 1])
+                    remaining = predictor.remaining()
+                    if warning is not None and n not in warned and remaining is not None and remaining <= warning: # no warning if blank
+                        warned.add(n)
+                        self.signalStatus.emit('QCM%d reaches target in %.0f s'%(n, remaining))
+                        self.InficonConsole.emit('QCM%d reaches %g kA in about %.0f s'%(n, predictor.target, remaining))
+                if predictors and all(predictor.reached() for predictor in predictors.values()):
+                    self.signalStatus.emit('Target thickness reached')
+                    self.InficonConsole.emit('Target thickness reached, monitoring stopped.')
+                    break
+                clock.wait()
+        finally: # also after an error, the file keeps what was measured
+            try:
+                inficon_engine.disconnect(self)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+        if clock.missed:
+            self.InficonConsole.emit('%d sample deadlines missed, QCM_sampleTime is shorter than a readout'%clock.missed)
+        if save and len(self.QCM_samples):
+            self.endDepositionData.emit(deposition_columns(self.QCM_samples.all()))
+        self.QCM_samples.close()
         
         
\ No newline at end of file
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Simulated Inficon SQM-160/SQC-310 on a Linux pseudo terminal, so inficon310C and the
+deposition engine run without the controller. Set QCM_port to 'Simulated', or point
+inficon310C at the port of a running SimulatedInficon.
+"""
+
+import os
+import pty
+import select
+import sys
+import threading
+import time
+import tty
+import numpy as np
+
+from src.inficon_control import crc_bytes, CHANNELS
+
+VERSION = 'SQC-310 SIMULATED'
+
+class SimulatedInficon(object):
+    """ Controller with four crystals, each growing a film at rate [A/s] with relative noise.
+    Every reply waits latency [s] before it is written, a fraction corruption of the replies
+    get a wrong crc. The noise and corruption are seeded so runs repeat """
+    def __init__(self, rates=(1.0, 0.5, 0.2, 0.1), noise=0.02, latency=0.005, corruption=0.0,
+                 seed=0, frequency=6.0e6, hzPerKA=2.0e3, minFrequency=5.0e6):
+        self.rates = [float(rate) for rate in rates]
+        self.noise = float(noise)
+        self.latency = float(latency)
+        self.corruption = float(corruption)
+        self.rng = np.random.RandomState(seed)
+        self.startFrequency = float(frequency) # Hz of a fresh crystal
+        self.hzPerKA = float(hzPerKA) # frequency drop per kA of film
+        self.minFrequency = float(minFrequency) # Hz where crystal life reaches 100 %
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave) # no echo or line editing on the port
+        self.port = os.ttyname(self.slave)
+        self.replies = 0 # frames answered
+        self.corrupted = 0 # frames answered with a wrong crc
+        self.errors = 0 # frames with a bad crc or unknown command
+        self.running = False
+        self.thread = None
+        self.started = time.monotonic()
+
+    def start(self):
+        """ Answer frames in a background thread until stop """
+        self.running = True
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.serve, name='Inficon simulation', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def thickness(self, channel):
+        """ kA of film on crystal channel """
+        return self.rates[channel - 1]*(time.monotonic() - self.started)/1000
+
+    def reply(self, command):
+        """ Payload answering command, status byte first ('A' ok, 'C' unknown command) """
+        if command == '@':
+            return 'A' + VERSION
+        if command.startswith('A1 ') and command.endswith('?'):
+            return 'A' + 'FILM%s'%command[3:-1].strip()
+        try:
+            channel = int(command[-1])
+            if not 1 <= channel <= CHANNELS:
+                raise ValueError
+        except ValueError:
+            return 'C'
+        kind = command[:-1]
+        thickness = self.thickness(channel)
+        frequency = self.startFrequency - self.hzPerKA*thickness
+        if kind == 'N':
+            return 'A%.4f'%thickness
+        if kind == 'L':
+            return 'A%.3f'%(self.rates[channel - 1]*(1 + self.noise*self.rng.randn()))
+        if kind == 'P':
+            return 'A%.3f'%frequency
+        if kind == 'PA':
+            life = 100*(self.startFrequency - frequency)/(self.startFrequency - self.minFrequency)
+            return 'A%s %.3f %.2f'%('O', frequency, life)
+        return 'C'
+
+    def frame(self, payload):
+        """ '!', length byte, payload and crc, corrupted with probability corruption """
+        data = bytes([len(payload) + 34]) + payload.encode('latin-1')
+        crc = crc_bytes(data)
+        if self.rng.rand() < self.corruption:
+            crc = bytes([crc[0], 34 + (crc[1] - 33)%128])
+            self.corrupted += 1
+        return b'!' + data + crc
+
+    def serve(self):
+        """ Read command frames from the pty and answer each one """
+        buffer = b''
+        while self.running:
+            if not select.select([self.master], [], [], 0.1)[0]:
+                continue # check running now and then
+            try:
+                chunk = os.read(self.master, 4096)
+            except OSError: # port closed
+                break
+            buffer += chunk
+            while True:
+                start = buffer.find(b'!')
+                if start < 0:
+                    buffer = b''
+                    break
+                buffer = buffer[start:]
+                if len(buffer) < 2 or len(buffer) < buffer[1] - 34 + 4:
+                    break # frame not complete yet
+                n = buffer[1] - 34
+                frame, buffer = buffer[:n + 4], buffer[n + 4:]
+                if n < 0 or crc_bytes(frame[1:-2]) != frame[-2:]:
+                    self.errors += 1
+                    continue
+                payload = self.reply(frame[2:-2].decode('latin-1'))
+                if payload == 'C':
+                    self.errors += 1
+                time.sleep(self.latency)
+                os.write(self.master, self.frame(payload))
+                self.replies += 1
+
+
+if __name__ == "__main__":
+    # Repeatable timing of the driver against the simulation: python3 -m src.inficon_sim [corruption]
+    from src.inficon_control import inficon310C
+    corruption = float(sys.argv[1]) if len(sys.argv) > 1 else 0.0
+    sim = SimulatedInficon(corruption=corruption).start()
+    inficon = inficon310C(port=sim.port, timeout=0.2)
+    print(inficon.show_version())
+    start = time.monotonic()
+    for n in range(100):
+        inficon.thickness(1)
+    print('100 x thickness: %.3f s'%(time.monotonic() - start))
+    start = time.monotonic()
+    for n in range(100):
+        record = inficon.read_channels()
+    print('100 x read_channels: %.3f s, last record %s'%(time.monotonic() - start, record))
+    print('timeouts %d, crc errors %d, corrupted replies %d'%(inficon.timeouts, inficon.crcErrors, sim.corrupted))
+    sim.stop()
@@ -0,0 +1,104 @@
+'''
+In-situ conductivity during deposition. The QCM is read on its own thread while the
+Keithley takes fixed-bias readings on the worker thread, both on one monotonic timebase,
+and every Keithley reading is joined with the film thickness at the time it was taken.
+'''
+
+import threading
+import numpy as np
+
+from src.inficon_engine import inficon_engine, deposition_columns, SAMPLES_IN_MEMORY
+from src.inficon_control import QCM_RECORD
+from src.measurement_engine import IV_Engine, calc_conductivity
+from src.ring_buffer import RingBuffer
+from src.scheduler import DeadlineClock
+
+INSITU_COLUMNS = ('Time', 'Thickness', 'Rate', 'Voltage', 'Current', 'Conductivity')
+INSITU_RECORD = np.dtype([(name, 'f8') for name in INSITU_COLUMNS])
+
+def thickness_at(samples, channel, t):
+    '''Thickness [kA] and rate [A/s] of channel at time t, interpolated between the QCM samples
+    around t or extrapolated from the last two. NaN before there are any'''
+    latest = samples.latest(2)
+    if not len(latest):
+        return np.nan, np.nan
+    thickness, rate = latest['thickness'][:, channel - 1], latest['rate'][:, channel - 1]
+    if len(latest) < 2 or latest['time'][1] == latest['time'][0]:
+        return thickness[-1], rate[-1]
+    slope = (thickness[1] - thickness[0])/(latest['time'][1] - latest['time'][0])
+    return thickness[1] + slope*(t - latest['time'][1]), rate[1]
+
+
+class insitu_engine():
+    '''Combined QCM and Keithley acquisition, run on a worker like the other engines'''
+
+    def monitor(self):
+        '''Until stopped: QCM every QCM_sampleTime, Keithley at fixedV every pauseTime.
+        Streams (t, thickness, rate, V, I, conductivity) rows for channel insituChannel'''
+        pars = self.user_parameters.value
+        channel = pars['insituChannel']
+        channels = [n for n in range(1, 5) if pars['QCM%d'%n] or n == channel]
+        width = pars['OFET_width']
+        smu, rm = IV_Engine.connect2Keith(self)
+        inficon_engine.connect(self)
+        writer = None
+        qcm = None
+        readings = 0
+        try:
+            if pars['saveData']:
+                try:
+                    import src.Utilities as Utilities #only needed when saving
+                    writer = Utilities.StreamingFMFWriter(self.user_parameters.frame())
+                except Exception as error:
+                    print('### In-situ data can not be streamed to file: %s ###'%error)
+            self.QCM_samples = RingBuffer(QCM_RECORD, capacity=SAMPLES_IN_MEMORY, spill=False)
+            lock = threading.Lock() # QCM_samples is written by one thread and read by the other
+            self.InficonConsole.emit('In-situ conductivity on QCM%d at %s V...'%(channel, pars['fixedV']))
+            self.signalStatus.emit('Monitoring in-situ conductivity...')
+
+            qcmClock = DeadlineClock(pars['QCM_sampleTime'], lambda: self._flag)
+            smuClock = DeadlineClock(pars['pauseTime'], lambda: self._flag)
+            smuClock.start(qcmClock.start().started) # shared timebase
+
+            def readQCM():
+                try:
+                    while self._flag == False:
+                        sampletime, record = qcmClock.stamp(lambda: self.inficon.read_channels(channels))
+                        record['time'] = sampletime
+                        with lock:
+                            self.QCM_samples.append(record)
+                            columns = deposition_columns(self.QCM_samples.latest(1))
+                        self.newDepositionDataPoint.emit(columns)
+                        qcmClock.wait()
+                except Exception as error: # eg serial port lost, no thickness for the readings after this
+                    self.InficonConsole.emit('### QCM readout failed: %s ###'%error)
+                    self.signalStatus.emit('QCM readout failed, in-situ monitoring stopped')
+                    self._flag = True
+            qcm = threading.Thread(target=readQCM, name='QCM')
+            qcm.start()
+
+            while self._flag == False:
+                t, (v, i) = smuClock.stamp(lambda: smu.measV(pars))
+                with lock:
+                    thickness, rate = thickness_at(self.QCM_samples, channel, t)
+                # film thickness from the QCM, kA -> nm
+                sigma = calc_conductivity(float(i), float(v), width, thickness*100) if thickness > 0 else np.nan
+                row = (t, float(thickness), float(rate), float(v), float(i), sigma)
+                readings += 1
+                self.newInsituDataPoint.emit(row)
+                if writer is not None:
+                    writer.append(row)
+                smuClock.wait()
+        finally: # also after an error, the file keeps what was measured
+            self._flag = True
+            if qcm is not None:
+                qcm.join()
+            try:
+                inficon_engine.disconnect(self)
+            finally:
+                if writer is not None:
+                    writer.close()
+        for name, clock in (('QCM', qcmClock), ('Keithley', smuClock)):
+            if clock.missed:
+                self.InficonConsole.emit('%s missed %d sample deadlines'%(name, clock.missed))
+        self.InficonConsole.emit('In-situ monitoring complete, %d readings.'%readings)
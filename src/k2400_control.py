@@ -10,18 +10,105 @@ import visa
 import sys
 import numpy as np
 import time
+import threading
+import functools
+
+from src.comm_stats import isTimeout
 
 defaultstdout = sys.stdout #save default console print location
 
+# settings that change each other on the instrument: writing one invalidates the cached value of the others
+COUPLED_SETTINGS = [
+	('SOUR:VOLT:STAR', 'SOUR:VOLT:STOP', 'SOUR:VOLT:STEP', 'SOUR:SWE:POIN', 'SOUR:VOLT:CENT', 'SOUR:VOLT:SPAN'),
+	('SENS:CURR:RANG', 'SENS:CURR:RANG:AUTO', 'SENS:CURR:PROT'), # real compliance is limited by the range
+	('SOUR:VOLT:RANG', 'SOUR:VOLT:RANG:AUTO'),
+]
+# settings the instrument changes by itself, never skip these
+UNCACHED_SETTINGS = ('TRAC:FEED:CONT',)
+BUFFER_SIZE = 2500 # readings the 2400 TRACe buffer can hold
+LIST_POINTS = 100 # source memory list length of the 2400
+CURRENT_RANGES = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1) # A, measure ranges of the 2400
+OVERFLOW = 9.9e37 # returned for readings above the measure range
+RANGE_HEADROOM = 0.5 # lock the range that fits twice the remembered current
+RANGE_UNDERFLOW = 0.01 # readings below this fraction of the locked range go back to autorange
+
+def scpi_header(command):
+	'''Reduce a SCPI command to (short form header, argument) so that e.g.
+	':SOURce:SWEep:DIREction UP' and 'SOUR:SWE:DIRE UP' compare equal'''
+	command = command.strip()
+	header, _, argument = command.partition(' ')
+	query = '?' if header.endswith('?') else ''
+	nodes = []
+	for node in header.lstrip(':').rstrip('?').upper().split(':'):
+		if len(node) > 4 and not node.startswith('*'):
+			node = node[:3] if node[3] in 'AEIOU' else node[:4] #SCPI short form rule
+		nodes.append(node)
+	while len(nodes) > 1 and nodes[-1] in ('IMM', 'AMPL'): #optional default nodes
+		nodes.pop()
+	return ':'.join(nodes) + query, argument.strip()
+
+def sweep_levels(initialV, finalV, stepSize, spacing='LIN', dual=False):
+	'''Voltages of a staircase from initialV to finalV, LIN with stepSize steps or LOG with
+	the same number of points. dual adds the way back for hysteresis checks.'''
+	initialV, finalV, stepSize = float(initialV), float(finalV), abs(float(stepSize))
+	points = int(round(abs(finalV - initialV)/stepSize)) + 1 if stepSize else 1
+	if str(spacing).upper().startswith('LOG'):
+		if initialV*finalV <= 0:
+			raise ValueError('log sweep from %s V to %s V crosses zero'%(initialV, finalV))
+		levels = np.geomspace(initialV, finalV, points)
+	else:
+		levels = np.linspace(initialV, finalV, points)
+	if dual:
+		levels = np.concatenate((levels, levels[-2::-1]))
+	return levels
+
+def current_range(i):
+	'''Smallest measure range that fits current i with RANGE_HEADROOM to spare'''
+	for r in CURRENT_RANGES:
+		if abs(i) <= RANGE_HEADROOM*r:
+			return r
+	return CURRENT_RANGES[-1]
+
+def exclusive(method):
+	'''Run method holding the session lock, so workers sharing one k2400 do not interleave
+	their commands and responses (or the steps of a measurement)'''
+	@functools.wraps(method)
+	def run(self, *args, **kwargs):
+		with self.lock:
+			return method(self, *args, **kwargs)
+	return run
+
 class k2400():
 	'''Class to control keithley SMU'''
 	def __init__(self, rm, connectionPars):
 		'''Connect to the Keithley?'''
 		self.inst = k2400.inst_connect(rm, connectionPars)
+		self.name = k2400.instrumentName(connectionPars) # tells SMUs apart in messages and statistics
+		self.cacheSettings = True # skip writes that would not change the instrument state
+		self.state = {} # shadow copy of the settings sent since the last *RST/connect
+		self.binaryTransfer = True # read data as single precision floats (FORM:DATA SREAL), ASCII otherwise
+		self.lineFreq = None # power line frequency in Hz, asked from the instrument on first use
+		self.pointOverhead = 0.005 # s per reading on top of source delay and integration (autozero, trigger model)
+		self.pollInterval = 0.05 # s between operation complete checks
+		self.timeoutMargin = 5 # s added to twice the expected duration before giving up on an acquisition
+		self.stats = None # comm_stats.CommStats recording every command, None to disable
+		self.rangeMemory = {} # (device, bias): current range found for it
+		self.lock = threading.RLock() # held for every command/response pair and measurement
 		
 		
+	def instrumentName(connectionPars):
+		'''Keithley and its address'''
+		pars = connectionPars.value
+		if str(pars['connectionType']) == 'GPIB':
+			return 'Keithley GPIB%s::%s'%(pars['gpibPrefix'], pars['gpibAd'])
+		return 'Keithley %s %s'%(pars['connectionType'], pars['serAd'])
+
 	def inst_connect(rm, connectionPars):
 		'''function to return a pyvisa Resource given some pars currently only works for serial'''
+		if str(connectionPars.value['connectionType']) == 'Simulated':
+			from src.k2400_sim import SimulatedK2400 #only needed without hardware
+			return SimulatedK2400.fromPars(connectionPars)
+
 		if str(connectionPars.value['connectionType']) == 'Serial':
 			try:
 				baudR = int(connectionPars.value['baudR'])
@@ -40,6 +127,7 @@ class k2400():
 			try:
 				address = 'GPIB%s::%s::INSTR'%(connectionPars['gpibPrefix'], connectionPars['gpibAd'])
 				inst = rm.open_resource(address)
+				return inst
 			except:
 				print('### Problem connecting to Keithely using GPIB ###')
 		
@@ -47,6 +135,13 @@ class k2400():
 		else:	
 			raise Exception('connection type %s not suported for SMU'%connectionPars.value['connectionType'])
 	
+	def close(self):
+		'''Release the instrument'''
+		try:
+			self.inst.close()
+		except Exception:
+			pass
+
 	def input2unicode(s):
 		s = s.replace('\\r','\r')
 		s = s.replace('\\n','\n')
@@ -54,20 +149,188 @@ class k2400():
 		
 	def connect_SMU(connSet):
 		'''Method to connect to keithley'''
-		rm = visa.ResourceManager('@py') #use py-visa backend
+		if str(connSet.value['connectionType']) == 'Simulated':
+			rm = None #no visa library needed
+		else:
+			rm = visa.ResourceManager('@py') #use py-visa backend
 		smu = k2400(rm, connSet)
 		return smu, rm		
 
+	@exclusive
 	def write(self, s):
-		'''Standard pyvisa write no added debug'''
-		self.inst.write(s)
+		'''pyvisa write that skips settings already present on the instrument'''
+		header, argument = scpi_header(s)
+		if header in ('*RST', 'SYST:PRES'):
+			self.clearState()
+		elif self.cacheSettings and argument and not header.startswith('*') and header not in UNCACHED_SETTINGS:
+			if self.state.get(header) == argument:
+				if self.stats is not None:
+					self.stats.record(header, 0, skipped=True)
+				return
+			for group in COUPLED_SETTINGS:
+				if header in group:
+					for other in group:
+						self.state.pop(other, None)
+			self.state[header] = argument
+		start = time.perf_counter() if self.stats is not None else 0
+		try:
+			self.inst.write(s)
+		except Exception as error:
+			self.state.pop(header, None) # unknown whether the setting arrived
+			if self.stats is not None:
+				self.stats.record(header, time.perf_counter() - start, timeout=isTimeout(error))
+			raise
+		if self.stats is not None:
+			self.stats.record(header, time.perf_counter() - start, len(s) + 1)
+
+	def clearState(self):
+		'''Forget the shadow copy of the instrument settings, eg after *RST or front panel use'''
+		self.state = {}
+
+	def reset(self):
+		'''Return the instrument to its *RST defaults'''
+		self.write('*RST')
+
+	def lineFrequency(self):
+		'''Power line frequency, needed to turn NPLC into seconds'''
+		if self.lineFreq is None:
+			try:
+				self.lineFreq = float(self.query('SYST:LFR?'))
+			except Exception:
+				self.lineFreq = 50.0
+		return self.lineFreq
+
+	def expectedDuration(self, points, delay, nplc):
+		'''Time the trigger model needs for points readings with source delay and integration time nplc'''
+		return points*(float(delay) + float(nplc)/self.lineFrequency() + self.pointOverhead)
+
+	def startAcquisition(self):
+		'''Arm the trigger model and ask for the operation complete bit when it is done'''
+		self.write('*CLS') #clear event status register
+		self.write('INIT')
+		self.write('*OPC') #sets OPC bit of the event status register when INIT finishes
+
+	def waitForCompletion(self, expected, timeout=None, check=None, interval=None):
+		'''Poll the event status register until the acquisition started by startAcquisition
+		has finished. Returns the time waited, aborts and raises TimeoutError after timeout seconds.
+		If given, check() is called every interval seconds while waiting, returning True aborts.'''
+		if timeout is None:
+			timeout = 2*expected + self.timeoutMargin
+		if interval is None:
+			interval = self.pollInterval
+		start = time.monotonic()
+		if check is None:
+			time.sleep(max(0, 0.9*expected - interval)) #nothing to poll for until then
+		while not int(self.query('*ESR?')) & 1: #bit 0 = operation complete
+			elapsed = time.monotonic() - start
+			if check is not None and check():
+				self.write('ABOR')
+				break
+			if elapsed > timeout:
+				self.write('ABOR')
+				raise TimeoutError('Keithley acquisition not complete after %.1f s (expected %.1f s)'%(elapsed, expected))
+			time.sleep(interval)
+		return time.monotonic() - start
+
+	@exclusive
+	def readValues(self, command, count):
+		'''Send a data query (READ?, FETC?) and return its count readings as an np.array.
+		Binary transfer falls back to ASCII for good if the instrument or pyvisa does not cooperate.
+		The fallback fetches the readings already taken (FETC? for READ?) rather than triggering again.'''
+		if self.binaryTransfer:
+			sent = False # command reached the instrument
+			try:
+				self.write('FORM:BORD SWAP') #little endian byte order
+				self.write('FORM:DATA SREAL') #4 byte IEEE754 floats
+				start = time.perf_counter()
+				self.inst.write(command)
+				sent = True
+				block = self.inst.read_bytes(2 + 4*count) #'#0' header then data, no length field
+				if block[:2] != b'#0':
+					raise ValueError('unexpected binary block header %r'%block[:2])
+				self.inst.read_bytes(len(self.inst.read_termination or '\n')) #remove terminator from input buffer
+				if self.stats is not None:
+					self.stats.record(scpi_header(command)[0], time.perf_counter() - start, len(command) + len(block) + 2)
+				return np.frombuffer(block, dtype='<f4', count=count, offset=2).astype(float)
+			except Exception:
+				print('### Binary transfer failed, falling back to ASCII: %s ###'%(sys.exc_info()[1],))
+				self.binaryTransfer = False
+				try:
+					self.inst.clear()
+				except Exception:
+					pass
+			if sent and scpi_header(command)[0] == 'READ?':
+				command = 'FETC?' #READ? would start another measurement (or sweep)
+		self.write('FORM:DATA ASC')
+		return np.fromstring(self.query(command), sep =',') #convert str to np.array
 
+	@exclusive
 	def query(self, s):
-		'''Standard pyvisa query no added debug'''
-		a = self.inst.query(s)
+		'''Standard pyvisa query, timed if stats are on'''
+		if self.stats is None:
+			return self.inst.query(s)
+		start = time.perf_counter()
+		try:
+			a = self.inst.query(s)
+		except Exception as error:
+			self.stats.record(scpi_header(s)[0], time.perf_counter() - start, timeout=isTimeout(error))
+			raise
+		self.stats.record(scpi_header(s)[0], time.perf_counter() - start, len(s) + 1 + len(a))
 		return a
 
 	
+	def rangeKey(pars, bias):
+		'''Range memory key: the OFET measured and the bias voltage'''
+		return (str(pars.get('OFET_width')), str(pars.get('OFET_no')), round(float(bias), 6))
+
+	def learnRanges(self, pars, v, i):
+		'''Remember the ranges needed at +-fixedV from a sweep that covers them'''
+		try:
+			biases = (float(pars['fixedV']), -float(pars['fixedV']))
+		except (KeyError, TypeError, ValueError):
+			return # no fixed voltage measurement to prepare for
+		order = np.argsort(v)
+		for bias in biases:
+			if v[order[0]] <= bias <= v[order[-1]]:
+				current = np.interp(bias, v[order], np.abs(i[order]))
+				if current < OVERFLOW:
+					self.rangeMemory[k2400.rangeKey(pars, bias)] = current_range(current)
+
+	def setCurrentRange(self, pars, *biases):
+		'''Lock the largest range remembered for biases, autorange unless all are known.
+		Returns the locked range or None'''
+		ranges = [self.rangeMemory.get(k2400.rangeKey(pars, bias)) for bias in biases]
+		if None in ranges:
+			self.write(':SENS:CURR:RANG:AUTO ON') #Autorange for current measuremnet
+			return None
+		self.write(':SENS:CURR:RANG %g'%max(ranges))
+		return max(ranges)
+
+	def checkRange(self, pars, bias, i, locked):
+		'''False if reading i is unusable on the locked range (overflow, or far below it while
+		a lower range fits), the memory is then forgotten. Autoranged readings are remembered.'''
+		key = k2400.rangeKey(pars, bias)
+		if locked is None:
+			if abs(i) < OVERFLOW:
+				self.rangeMemory[key] = current_range(i)
+			return True
+		underflow = locked > CURRENT_RANGES[0] and abs(i) < RANGE_UNDERFLOW*locked and current_range(i) < locked # nothing below 1 uA
+		if abs(i) >= OVERFLOW or abs(i) > locked or underflow:
+			self.rangeMemory.pop(key, None)
+			return False
+		return True
+
+	@exclusive
+	def readCurrent(self, pars, bias, locked):
+		'''READ? a voltage, current pair on the locked range, again with autorange if out of range'''
+		v, i = self.readValues('READ?', 2)
+		if not self.checkRange(pars, bias, i, locked):
+			self.write(':SENS:CURR:RANG:AUTO ON')
+			v, i = self.readValues('READ?', 2)
+			self.checkRange(pars, bias, i, None)
+		return v, i
+
+	@exclusive
 	def measV(self, pars):
 		'''take a current measurement at fixed voltage V'''
 		self.write(':SYST:BEEP:STAT OFF') #TURN OFF annoying beeb
@@ -80,14 +343,102 @@ class k2400():
 		self.write(':SENS:CURR:PROT 1E%s'%pars['compliance']) # Sets compliance for measurement
 		self.write(':SENS:NPLC %s'%pars['integrationTime']) # Sets integration time for measurement
 		self.write(':SENS:FUNC "CURR"') #Choose current measurement function
-		self.write(':SENS:CURR:RANG:AUTO ON') #Autorange for current measuremnet
+		locked = self.setCurrentRange(pars, pars['fixedV']) #range found before, autorange otherwise
 		self.write(':FORM:ELEM VOLT,CURR') #voltage and current reading
 		self.write(':OUTP ON')
 		#print(self.query(':READ?'))
-		v, i =[float(x) for x in self.query('READ?').split(',')] #break data str into values
+		v, i = self.readCurrent(pars, pars['fixedV'], locked)
 		self.write('OUTP OFF')
 		return v, i
 	
+	@exclusive
+	def measVbuffered(self, pars, n, interval, newData=None, abort=None, refresh=0.5):
+		'''take n current measurements at fixed voltage, interval seconds apart, timed by the
+		instrument trigger model and stored in its TRACe buffer. newData(t, v, i) is called every
+		refresh seconds with all readings stored so far, abort() returning True stops early.
+		Returns time stamps (s since start), voltages and currents as np.arrays'''
+		if n > BUFFER_SIZE:
+			raise ValueError('%s readings do not fit the %s reading buffer'%(n, BUFFER_SIZE))
+		self.write(':SYST:BEEP:STAT OFF') #TURN OFF annoying beeb
+		self.write(':SOUR:FUNC VOLT')	#SELECT SOURCE
+		self.write(':SENS:FUNC:CONC OFF') #do not measure both V and I concurrently
+		self.write(':SOUR:VOLT:MODE FIXED') #fixed voltage source mode
+		self.write(':SOUR:VOLT:RANG:AUTO ON') #auto range for voltage
+		self.write(':SOUR:VOLT:LEV %s'%pars['fixedV']) #choose voltage for measurement
+		self.write(':SENS:CURR:PROT 1E%s'%pars['compliance']) # Sets compliance for measurement
+		self.write(':SENS:NPLC %s'%pars['integrationTime']) # Sets integration time for measurement
+		self.write(':SENS:FUNC "CURR"') #Choose current measurement function
+		self.write(':SENS:CURR:RANG:AUTO ON') #Autorange for current measuremnet
+		self.write(':FORM:ELEM VOLT,CURR,TIME') #voltage, current and time stamp per reading
+		self.write(':TRIG:COUN %s'%n) #one reading per trigger
+		self.write(':TRIG:DEL %s'%interval) #time between readings
+		return self.runBuffered(n, self.expectedDuration(n, interval, pars['integrationTime']), newData, abort, refresh)
+
+	@exclusive
+	def runBuffered(self, n, expected, newData=None, abort=None, refresh=0.5):
+		'''Store the next n readings in the TRACe buffer, switch the output on, run the configured
+		trigger model and return time stamps, voltages and currents. FORM:ELEM must be VOLT,CURR,TIME'''
+		self.write(':TRAC:CLE') #empty buffer
+		self.write(':TRAC:POIN %s'%n)
+		self.write(':TRAC:FEED SENS') #store raw readings
+		self.write(':TRAC:FEED:CONT NEXT') #fill buffer once
+		self.write(':SYST:TIME:RES') #time stamps start at zero
+		self.write(':OUTP ON')
+		stored = [0]
+		def check():
+			if newData is not None:
+				self.write('FORM:DATA ASC') #partial buffer length unknown, binary needs an exact count
+				actual = int(float(self.query('TRAC:POIN:ACT?')))
+				if actual > stored[0]:
+					data = np.fromstring(self.query('TRAC:DATA?'), sep =',')
+					stored[0] = len(data)//3
+					data = data[:3*stored[0]]
+					newData(data[2::3], data[::3], data[1::3])
+			return abort is not None and abort()
+		try:
+			self.startAcquisition()
+			self.waitForCompletion(expected, check=check, interval=refresh)
+			actual = int(float(self.query('TRAC:POIN:ACT?')))
+			data = self.readValues('TRAC:DATA?', 3*actual) if actual else np.zeros(0)
+		finally:
+			self.write(':OUTP OFF')
+			self.write(':TRIG:DEL 0') #also after an abort, the session is reused
+		return data[2::3], data[::3], data[1::3]
+
+	@exclusive
+	def measConductivityPipelined(self, pars, n, newData=None, abort=None, refresh=0.5):
+		'''n conductivity readings from one trigger model run: the source list alternates
+		-fixedV (reverse bias soak) and fixedV, each held for pauseTime by the source delay.
+		Only the forward readings are returned (and passed to newData) as time stamps, v, i'''
+		if 2*n > BUFFER_SIZE:
+			raise ValueError('%s repeats do not fit the %s reading buffer'%(n, BUFFER_SIZE))
+		self.write(':SYST:BEEP:STAT OFF') #TURN OFF annoying beeb
+		self.write("ROUTe:TERM %s"%pars['route']) #select front/rear channel
+		self.write("SYST:RSEN %s"%pars['4wire']) #4 wire measurement or two wire?
+		self.write(':SOUR:FUNC VOLT')	#SELECT SOURCE
+		self.write(':SENS:FUNC:CONC OFF') #do not measure both V and I concurrently
+		self.write(':SOUR:VOLT:RANG:AUTO ON') #auto range for voltage
+		self.write(':SOUR:VOLT:LEV %g'%-float(pars['fixedV'])) #start at reverse bias
+		self.write(':SOUR:LIST:VOLT %g,%g'%(-float(pars['fixedV']), float(pars['fixedV']))) #reverse soak, forward reading
+		self.write(':SOUR:VOLT:MODE LIST')
+		self.write(':SOUR:DEL %s'%pars['pauseTime']) #bias held this long before each reading
+		self.write(':SENS:CURR:PROT 1E%s'%pars['compliance']) # Sets compliance for measurement
+		self.write(':SENS:NPLC %s'%pars['integrationTime']) # Sets integration time for measurement
+		self.write(':SENS:FUNC "CURR"') #Choose current measurement function
+		self.write(':SENS:CURR:RANG:AUTO ON') #Autorange for current measuremnet
+		self.write(':FORM:ELEM VOLT,CURR,TIME') #voltage, current and time stamp per reading
+		self.write(':TRIG:COUN %s'%(2*n)) #list repeats n times
+		self.write(':TRIG:DEL 0')
+		def forward(t, v, i):
+			newData(t[1::2], v[1::2], i[1::2])
+		expected = self.expectedDuration(2*n, pars['pauseTime'], pars['integrationTime'])
+		try:
+			t, v, i = self.runBuffered(2*n, expected, None if newData is None else forward, abort, refresh)
+		finally:
+			self.write(':SOUR:DEL 0') #do not hold later fixed voltage readings for pauseTime
+		return t[1::2], v[1::2], i[1::2]
+
+	@exclusive
 	def measIVsweep(self, pars):
 		'''make an IV sweep'''
 		self.write(':SYST:BEEP:STAT OFF') #TURN OFF annoying beeb
@@ -101,38 +452,82 @@ class k2400():
 		self.write("SENS:CURR:RANG 1E%s"%pars['compliance']) # current range to measure
 		self.write("SENS:NPLC %s"%pars['integrationTime']) # Sets integration time for measurement
 	
+		stepSize = abs(float(pars['stepSize']))
 		if float(pars['initialV'])<float(pars['finalV']):
 			direction = 'UP'
 		else: 
 			direction = 'DOWn'
-			pars['stepSize'] = str(float(pars['stepSize'])*-1)
+			stepSize = -stepSize
 	
 		#Sweep Settings: sweep structure seems to trig, delay, trig delay
 		self.write("SOUR:VOLT:STARt %s"%pars['initialV']) # in V 
 		self.write("SOUR:VOLT:STOP %s"%pars['finalV']) # in V
-		self.write("SOUR:VOLT:STEP %s"%pars['stepSize']) # in V       
+		self.write("SOUR:VOLT:STEP %s"%stepSize) # in V       
 		self.write("SOUR:DEL %s"%pars['holdTime']) # delay in s
 		self.write("SOUR:VOLT:MODE SWE")    #select voltage sweep mode
 		self.write("SOUR:SWE:RANG AUTO")    #Auto source ranging
 		self.write("SOUR:SWE:SPAC LIN")    #linear sweep
 		self.write(":SOURce:SWEep:DIREction %s" % (direction) )#up/down
-		self.write("TRIG:COUN %s" % (self.query("SOUR:SWE:POIN?"))) # set trigger to number of points in sweep
+		points = int(float(self.query("SOUR:SWE:POIN?")))
+		self.write("TRIG:COUN %s" % points) # set trigger to number of points in sweep
 	
 		self.write("FORM:ELEM VOLT,CURR") #configure what READ will return, RES problematic
 	
 		#measure
 		self.write(":SOUR:VOLT:LEV %s"%pars['initialV'])
 		self.write("OUTP ON")    #turns on SMU at SOUR:VOL:STARtrig
-		# READtriggers sweep (INIT) + (FETCH) data
-		time.sleep(5) #two second pause to allow instrument to settle
-		self.query('*OPC?') #check op complete
-		data = np.fromstring(self.query("READ?"), sep =',') #convert str to np.array
+		try:
+			# INIT runs the sweep, wait for it to finish then FETCH data
+			self.startAcquisition()
+			self.waitForCompletion(self.expectedDuration(points, pars['holdTime'], pars['integrationTime']))
+			data = self.readValues("FETC?", 2*points) #voltage, current pairs
+		finally:
+			self.write('OUTP OFF')
 		i_data = data[1::2]
 		v_data = data[::2]
-		self.write('OUTP OFF')
+		self.learnRanges(pars, v_data, i_data) #for the fixed voltage readings that follow
 		
 		return v_data,i_data 	
 
+	@exclusive
+	def measListSweep(self, pars, levels):
+		'''make a sweep through an arbitrary list of voltages from source memory,
+		up to LIST_POINTS at a time with the output staying on in between'''
+		self.write(':SYST:BEEP:STAT OFF') #TURN OFF annoying beeb
+		self.write("ROUTe:TERM %s"%pars['route']) #select front/rear channel
+		self.write("SENS:FUNC:CONC OFF") # measure only sens not sour
+		self.write("SYST:RSEN %s"%pars['4wire']) #4 wire measurement or two wire?
+	
+		self.write("SOUR:FUNC VOLT")    #voltage source function
+		self.write("SENS:FUNC 'CURR:DC'") #current sense function
+		self.write("SENS:CURR:PROT 1E%s"%pars['compliance']) # current compliance in A
+		self.write("SENS:CURR:RANG 1E%s"%pars['compliance']) # current range to measure
+		self.write("SENS:NPLC %s"%pars['integrationTime']) # Sets integration time for measurement
+		self.write("SOUR:DEL %s"%pars['holdTime']) # delay in s
+		self.write("SOUR:VOLT:MODE LIST")    #source memory list
+		self.write("SOUR:SWE:RANG AUTO")    #Auto source ranging
+		self.write("FORM:ELEM VOLT,CURR") #configure what READ will return
+	
+		v_data, i_data = [], []
+		self.write(":SOUR:VOLT:LEV %s"%levels[0])
+		self.write("OUTP ON")
+		try:
+			for start in range(0, len(levels), LIST_POINTS):
+				chunk = levels[start:start + LIST_POINTS]
+				self.write("SOUR:LIST:VOLT %s"%','.join('%.6g'%x for x in chunk))
+				self.write("TRIG:COUN %s"%len(chunk)) # one trigger per list point
+				self.startAcquisition()
+				self.waitForCompletion(self.expectedDuration(len(chunk), pars['holdTime'], pars['integrationTime']))
+				data = self.readValues("FETC?", 2*len(chunk)) #voltage, current pairs
+				v_data.append(data[::2])
+				i_data.append(data[1::2])
+		finally:
+			self.write('OUTP OFF')
+		v_data, i_data = np.concatenate(v_data), np.concatenate(i_data)
+		self.learnRanges(pars, v_data, i_data) #for the fixed voltage readings that follow
+		return v_data, i_data
+
+	@exclusive
 	def measConductivity(self, pars):
 		'''Prepare for conductivity measurement'''		
 		self.write(':SYST:BEEP:STAT OFF') #TURN OFF annoying beeb
@@ -145,7 +540,8 @@ class k2400():
 		self.write(':SOUR:VOLT:MODE FIXED') #fixed voltage source mode
 		self.write(':SOUR:VOLT:RANG:AUTO ON') #auto range for voltage
 		
-		self.write(':SOUR:VOLT:LEV -%s'%pars['fixedV']) # -(measurement voltage)V for 20 seconds
+		self.write(':SOUR:VOLT:LEV %g'%-float(pars['fixedV'])) # -(measurement voltage)V for 20 seconds
+		self.setCurrentRange(pars, pars['fixedV'], -float(pars['fixedV'])) #wide enough for both biases
 		self.write(':OUTP ON')
 		time_2_sleep = float(pars['pauseTime'])
 		time.sleep(time_2_sleep)
@@ -155,14 +551,69 @@ class k2400():
 		self.write(':SENS:CURR:PROT 1E%s'%pars['compliance']) # Sets compliance for measurement
 		self.write(':SENS:NPLC %s'%pars['integrationTime']) # Sets integration time for measurement
 		self.write(':SENS:FUNC "CURR"') #Choose current measurement function
-		self.write(':SENS:CURR:RANG:AUTO ON') #Autorange for current measuremnet
+		locked = self.setCurrentRange(pars, pars['fixedV']) #range found before, autorange otherwise
 		self.write(':FORM:ELEM VOLT,CURR') #voltage and current reading
 	
 		self.write(':OUTP ON')
 		time.sleep(time_2_sleep) #Sleep 10 seconds with output on.
-		v, i =[float(x) for x in self.query('READ?').split(',')] #break data str into values
+		v, i = self.readCurrent(pars, pars['fixedV'], locked)
 		self.write('OUTP OFF')
 	
-		return v, i			
-		
-	
\ No newline at end of file
+		return v, i
+
+
+class SMUSessions():
+	'''Keeps one open k2400 per connection so back to back runs do not pay for
+	resource manager creation and opening the port again'''
+	def __init__(self):
+		self.rm = None
+		self.smus = {} # connection key: k2400
+		self.lock = threading.Lock()
+
+	def connectionKey(connectionPars):
+		'''Everything that needs a new connection when it changes (serAd also tells simulations apart)'''
+		pars = connectionPars.value
+		connectionType = str(pars['connectionType'])
+		if connectionType == 'Serial':
+			return (connectionType, str(pars['serAdapt']), str(pars['serAd']), str(pars['baudR']), str(pars['termChar']))
+		return (connectionType,) + tuple(str(pars.get(key)) for key in ('gpibPrefix', 'gpibAd', 'serAd', 'simSeed', 'simResistance', 'simNonlinearity', 'simNoise', 'simSpeed', 'simSerial'))
+
+	def healthy(smu):
+		'''Cheap check that the instrument still answers'''
+		try:
+			return smu.inst is not None and smu.query('*OPC?').strip() == '1'
+		except Exception:
+			return False
+
+	def get(self, connectionPars):
+		'''Return (smu, rm) for connectionPars, reusing the open session if it still works.
+		A reused session forgets its cached settings: the instrument may have been reset,
+		power cycled or used by another program since'''
+		key = SMUSessions.connectionKey(connectionPars)
+		with self.lock:
+			smu = self.smus.get(key)
+			if smu is not None and not SMUSessions.healthy(smu):
+				print('### Keithley session lost, reconnecting ###')
+				smu.close()
+				smu = None
+			elif smu is not None:
+				with smu.lock: # after a measurement another worker may be running on it
+					smu.clearState()
+			if smu is None:
+				if key[0] != 'Simulated' and self.rm is None:
+					self.rm = visa.ResourceManager('@py') #use py-visa backend
+				smu = k2400(self.rm, connectionPars)
+				self.smus[key] = smu
+			return smu, self.rm
+
+	def closeAll(self):
+		'''Close every session, eg when the program quits'''
+		with self.lock:
+			for smu in self.smus.values():
+				smu.close()
+			self.smus = {}
+			if self.rm is not None:
+				self.rm.close()
+				self.rm = None
+
+smuSessions = SMUSessions() # shared by all workers
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Simulated Keithley 2400 for running the measurement engines without an SMU.
+Behaves like a pyvisa resource and understands the SCPI subset used by k2400_control.
+Select it with connectionType 'Simulated', the sim* parameters set up the device.
+'''
+
+import sys
+import time
+import numpy as np
+
+from src.k2400_control import scpi_header
+
+IDN = 'KEITHLEY INSTRUMENTS INC.,MODEL 2400,SIMULATED,C30'
+OVERFLOW = 9.91e37 # reading returned when the current is above the fixed range
+ELEMENTS = ('VOLT', 'CURR', 'RES', 'TIME', 'STAT') # FORM:ELEM order of the 2400
+DEFAULTS = { # *RST state of the settings the simulation cares about
+	'SOUR:FUNC': 'VOLT',
+	'SOUR:VOLT:MODE': 'FIXED',
+	'SOUR:VOLT:LEV': '0',
+	'SOUR:VOLT:STAR': '0',
+	'SOUR:VOLT:STOP': '0',
+	'SOUR:VOLT:STEP': '0',
+	'SOUR:SWE:DIR': 'UP',
+	'SOUR:LIST:VOLT': '0',
+	'SOUR:DEL': '0.001',
+	'SENS:CURR:PROT': '1.05E-4',
+	'SENS:CURR:RANG': '1.05E-4',
+	'SENS:CURR:RANG:AUTO': 'ON',
+	'SENS:NPLC': '1',
+	'TRIG:COUN': '1',
+	'TRIG:DEL': '0',
+	'FORM:ELEM': 'VOLT,CURR,RES,TIME,STAT',
+	'FORM:DATA': 'ASC',
+	'FORM:BORD': 'NORM',
+	'TRAC:POIN': '100',
+	'TRAC:FEED:CONT': 'NEV',
+	'OUTP': 'OFF',
+}
+
+class SimulatedK2400():
+	'''Keithley 2400 connected to a device with I = V/R*(1 + nonlinearity*V^2).
+	Readings have relative noise plus a noise floor, read high shortly after the source
+	level changes (settlingTime), take NPLC/lineFreq to integrate and clip at compliance.
+	All instrument durations are divided by speed, the noise is seeded so runs repeat.'''
+	def __init__(self, seed=0, resistance=1e9, nonlinearity=0, noise=1e-3, noiseFloor=1e-12,
+			settlingTime=0.01, lineFreq=50, autorangeTime=0.02, overhead=0.002, baudRate=None, speed=1.0):
+		self.rng = np.random.RandomState(seed)
+		self.resistance = float(resistance)
+		self.nonlinearity = float(nonlinearity)
+		self.noise = float(noise)
+		self.noiseFloor = float(noiseFloor)
+		self.settlingTime = float(settlingTime)
+		self.lineFreq = float(lineFreq)
+		self.autorangeTime = float(autorangeTime)
+		self.overhead = float(overhead)
+		self.baudRate = baudRate # None: no transfer time
+		self.speed = float(speed)
+		self.read_termination = '\r'
+		self.write_termination = '\r'
+		self.baud_rate = baudRate
+		self.timeout = 2000
+		self.output = b'' #bytes waiting to be read
+		self.reset()
+
+	def fromPars(connectionPars):
+		'''Create the simulation from the sim* connection parameters'''
+		pars = connectionPars.value
+		def par(key, default):
+			value = pars.get(key, default)
+			return default if value is None or str(value).strip() in ('', 'NA', 'nan') else value
+		baudRate = par('baudR', None) if str(par('simSerial', 'False')) == 'True' else None
+		return SimulatedK2400(seed=int(float(par('simSeed', 0))),
+			resistance=float(par('simResistance', 1e9)),
+			nonlinearity=float(par('simNonlinearity', 0)),
+			noise=float(par('simNoise', 1e-3)),
+			baudRate=None if baudRate is None else int(baudRate),
+			speed=float(par('simSpeed', 1.0)))
+
+	def reset(self):
+		'''*RST'''
+		self.settings = dict(DEFAULTS)
+		self.esr = 0
+		self.opcPending = False
+		self.busyUntil = 0
+		self.levelChanged = time.monotonic()
+		self.timeZero = time.monotonic()
+		self.readings = np.zeros((0, len(ELEMENTS))) #sample buffer of the last INIT
+		self.trace = np.zeros((0, len(ELEMENTS))) #TRACe buffer
+		self.traceTimes = np.zeros(0) #when each trace reading becomes available
+
+	### pyvisa resource interface ###
+
+	def write(self, s):
+		self._transfer(len(s) + 1)
+		header, argument = scpi_header(s)
+		if header.endswith('?'):
+			reply = self._query(header[:-1], argument) #binary replies are added to the output directly
+			self.output += reply.encode('ascii') + self.read_termination.encode('ascii')
+		else:
+			self._command(header, argument)
+		return len(s)
+
+	def read_bytes(self, count, **kwargs):
+		if len(self.output) < count:
+			raise TimeoutError('simulated read timeout: %s of %s bytes available'%(len(self.output), count))
+		data, self.output = self.output[:count], self.output[count:]
+		self._transfer(count)
+		return data
+
+	def read_raw(self):
+		end = self.output.find(self.read_termination.encode('ascii'))
+		if end < 0:
+			raise TimeoutError('simulated read timeout: no terminator')
+		return self.read_bytes(end + len(self.read_termination))
+
+	def read(self):
+		return self.read_raw().decode('ascii')[:-len(self.read_termination)]
+
+	def query(self, s):
+		self.write(s)
+		return self.read()
+
+	def clear(self):
+		self.output = b''
+
+	def close(self):
+		pass
+
+	### instrument model ###
+
+	def _transfer(self, nbytes):
+		'''Serial line time for nbytes of 10 bit characters'''
+		if self.baudRate:
+			time.sleep(nbytes*10.0/self.baudRate)
+
+	def _waitBusy(self):
+		'''Block like the instrument does until the trigger model is idle'''
+		remaining = self.busyUntil - time.monotonic()
+		if remaining > 0:
+			time.sleep(remaining)
+
+	def _float(self, header):
+		return float(self.settings[header])
+
+	def _command(self, header, argument):
+		if header == '*RST':
+			self.reset()
+		elif header == '*CLS':
+			self.esr = 0
+		elif header == '*OPC':
+			self.opcPending = True
+		elif header == 'INIT':
+			self._initiate()
+		elif header == 'ABOR':
+			self.busyUntil = time.monotonic()
+		elif header == 'TRAC:CLE':
+			self.trace = np.zeros((0, len(ELEMENTS)))
+			self.traceTimes = np.zeros(0)
+		elif header == 'SYST:TIME:RES':
+			self.timeZero = time.monotonic()
+		elif header == 'SOUR:LIST:VOLT:APP':
+			self.settings['SOUR:LIST:VOLT'] += ',' + argument
+		else:
+			if header in ('SOUR:VOLT:LEV', 'OUTP') and self.settings.get(header) != argument:
+				self.levelChanged = time.monotonic()
+			if header == 'SENS:CURR:RANG':
+				self.settings['SENS:CURR:RANG:AUTO'] = 'OFF'
+			self.settings[header] = argument.strip('"\'')
+
+	def _query(self, header, argument):
+		if header == '*IDN':
+			return IDN
+		if header == '*OPC':
+			self._waitBusy()
+			return '1'
+		if header == '*ESR':
+			if self.opcPending and time.monotonic() >= self.busyUntil:
+				self.esr |= 1
+				self.opcPending = False
+			esr, self.esr = self.esr, 0
+			return '%d'%esr
+		if header == 'SYST:LFR':
+			return '%g'%self.lineFreq
+		if header == 'SOUR:SWE:POIN':
+			return '%d'%len(self._sweepLevels())
+		if header == 'READ':
+			self._initiate()
+			return self._query('FETC', '')
+		if header == 'FETC':
+			self._waitBusy()
+			return self._format(self.readings)
+		if header == 'TRAC:POIN:ACT':
+			return '%d'%np.sum(self.traceTimes <= time.monotonic())
+		if header == 'TRAC:DATA':
+			return self._format(self.trace[self.traceTimes <= time.monotonic()])
+		return self.settings.get(header, '0')
+
+	def _sweepLevels(self):
+		'''Source levels stepped through by one sweep or list'''
+		mode = self.settings['SOUR:VOLT:MODE'].upper()
+		if mode.startswith('SWE'):
+			start, stop, step = self._float('SOUR:VOLT:STAR'), self._float('SOUR:VOLT:STOP'), self._float('SOUR:VOLT:STEP')
+			points = int(round(abs(stop - start)/abs(step))) + 1 if step else 1
+			levels = np.linspace(start, stop, points)
+			return levels[::-1] if self.settings['SOUR:SWE:DIR'].upper().startswith('DOWN') else levels
+		if mode == 'LIST':
+			return np.array([float(x) for x in self.settings['SOUR:LIST:VOLT'].split(',')])
+		return np.array([self._float('SOUR:VOLT:LEV')])
+
+	def _current(self, v, settled):
+		'''Current through the device settled seconds after the source reached v'''
+		i = v/self.resistance*(1 + self.nonlinearity*v**2)
+		i *= 1 + np.exp(-settled/self.settlingTime)
+		i += self.rng.normal(0, self.noise*abs(i) + self.noiseFloor)
+		compliance = self._float('SENS:CURR:PROT')
+		i = np.clip(i, -compliance, compliance)
+		if self.settings['SENS:CURR:RANG:AUTO'] == 'OFF' and abs(i) > 1.05*self._float('SENS:CURR:RANG'):
+			i = OVERFLOW
+		return i
+
+	def _initiate(self):
+		'''Run the trigger model: TRIG:COUN readings, each after trigger and source delay'''
+		start = max(time.monotonic(), self.busyUntil)
+		on = self.settings['OUTP'].upper() in ('ON', '1')
+		levels = self._sweepLevels() if on else np.zeros(1)
+		autorange = self.settings['SENS:CURR:RANG:AUTO'] == 'ON'
+		integration = self._float('SENS:NPLC')/self.lineFreq
+		trigDelay, sourDelay = self._float('TRIG:DEL'), self._float('SOUR:DEL')
+		count = int(float(self.settings['TRIG:COUN']))
+		readings = np.zeros((count, len(ELEMENTS)))
+		times = np.zeros(count)
+		levelChanged = self.levelChanged
+		t = start
+		for n in range(count):
+			v = levels[n % len(levels)]
+			t += trigDelay/self.speed
+			if len(levels) > 1: #sweeps and lists change level on every trigger
+				levelChanged = t
+			t += (sourDelay + self.overhead + (self.autorangeTime if autorange else 0))/self.speed
+			i = self._current(v, (t - levelChanged)*self.speed) if on else self.rng.normal(0, self.noiseFloor)
+			t += integration/self.speed
+			readings[n] = v, i, (v/i if i else OVERFLOW), (t - self.timeZero)*self.speed, 0
+			times[n] = t
+		self.levelChanged = levelChanged
+		self.readings = readings
+		self.busyUntil = t
+		if self.settings['TRAC:FEED:CONT'].upper().startswith('NEXT'):
+			room = int(float(self.settings['TRAC:POIN'])) - len(self.trace)
+			self.trace = np.concatenate((self.trace, readings[:room]))
+			self.traceTimes = np.concatenate((self.traceTimes, times[:room]))
+			if room <= count:
+				self.settings['TRAC:FEED:CONT'] = 'NEV' #buffer full
+
+	def _format(self, readings):
+		'''Readings as ASCII or SREAL according to FORM:DATA, FORM:BORD and FORM:ELEM'''
+		elements = [e.strip()[:4].upper() for e in self.settings['FORM:ELEM'].split(',')]
+		columns = [n for n, e in enumerate(ELEMENTS) if e in elements]
+		data = readings[:, columns].ravel()
+		if self.settings['FORM:DATA'].upper().startswith('SRE'):
+			dtype = '<f4' if self.settings['FORM:BORD'].upper().startswith('SWAP') else '>f4'
+			self.output += b'#0' + data.astype(dtype).tobytes()
+			return ''
+		return ','.join('%+.6E'%x for x in data)
+
+
+if __name__ == "__main__":
+	# Repeatable timing of the driver against the simulation: python3 -m src.k2400_sim [baud rate]
+	from types import SimpleNamespace
+	from src.k2400_control import k2400
+	connection = {'connectionType': 'Simulated', 'simSeed': 1, 'simResistance': 1e8,
+		'simSerial': str(len(sys.argv) > 1), 'baudR': sys.argv[1] if len(sys.argv) > 1 else 9600}
+	pars = {'route': 'Front', '4wire': 'Off', 'compliance': -3, 'integrationTime': 0.1,
+		'initialV': -5, 'finalV': 5, 'stepSize': 0.5, 'holdTime': 0.01, 'fixedV': 2, 'pauseTime': 0.1}
+	smu, rm = k2400.connect_SMU(SimpleNamespace(value=connection))
+	start = time.monotonic()
+	v, i = smu.measIVsweep(dict(pars))
+	print('IV sweep: %d points in %.3f s, R = %.4g Ohm'%(len(v), time.monotonic() - start, np.polyfit(i, v, 1)[0]))
+	start = time.monotonic()
+	for n in range(20):
+		smu.measV(pars)
+	print('20 x measV: %.3f s'%(time.monotonic() - start))
+	start = time.monotonic()
+	t, v, i = smu.measVbuffered(pars, 100, 0.01)
+	print('100 buffered readings: %.3f s, instrument time %.3f s'%(time.monotonic() - start, t[-1]))
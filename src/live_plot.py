@@ -0,0 +1,138 @@
+'''
+Live graphs on a MatplotlibWidget for fast acquisitions. Lines are created once and get
+new data with set_data, updates are coalesced to at most fps redraws a second, and only the
+axes are blitted over a cached background unless the data leave the current limits. Long
+series are decimated for display, the full data are kept. The lines are animated artists,
+left out of normal draws, so saving the figure (toolbar or savefig) includes them itself.
+'''
+
+import numpy as np
+from PyQt4.QtCore import QTimer
+
+def decimate(x, y, points):
+    '''At most about points of (x, y) for display: the minimum and maximum y of equal
+    buckets, in their original order, so peaks and noise bands stay visible'''
+    n = len(y)
+    if n <= points:
+        return x, y
+    size = int(np.ceil(2.0*n/points)) # two points per bucket
+    buckets = n//size
+    rows = y[:buckets*size].reshape(buckets, size)
+    start = np.arange(buckets)*size
+    low = np.argmin(np.where(np.isnan(rows), np.inf, rows), axis=1)
+    high = np.argmax(np.where(np.isnan(rows), -np.inf, rows), axis=1)
+    keep = np.unique(np.concatenate((start + low, start + high, np.arange(buckets*size, n))))
+    return x[keep], y[keep]
+
+
+class LivePlot():
+    '''Named lines on the axes of a MatplotlibWidget, redrawn by a timer instead of on every
+    new point. set() gives a line new data (kept as is, eg the lists an engine is still
+    filling), show() switches the graph to another title and labels.'''
+
+    def __init__(self, widget, axes, fps=20, points=2000, headroom=0.1):
+        self.widget = widget
+        self.canvas = widget.load()
+        self.axes = axes
+        self.points = points # per line on screen
+        self.headroom = headroom # fraction of the data range added on each side when rescaling
+        self.series = {} # name: [x, y, line]
+        self.order = [] # names, oldest first
+        self.dirty = False
+        self.title = None
+        self.background = None
+        self.saving = False
+        self.canvas.mpl_connect('draw_event', self.drawn)
+        self.printFigure = self.canvas.print_figure
+        self.canvas.print_figure = self.save # used by savefig and the toolbar's Save
+        self.timer = QTimer()
+        self.timer.setInterval(int(1000/fps))
+        self.timer.timeout.connect(self.refresh)
+
+    def show(self, title, xlabel, ylabel):
+        '''Empty graph with these labels, unless it already shows title'''
+        if title == self.title:
+            return
+        self.title = title
+        self.axes.clear()
+        self.series = {}
+        self.order = []
+        self.axes.figure.suptitle(title)
+        self.axes.set_xlabel(xlabel)
+        self.axes.set_ylabel(ylabel)
+        self.axes.figure.tight_layout()
+        self.canvas.draw()
+
+    def clear(self):
+        '''Empty graph on the next show(), eg for a new run with the same title'''
+        self.title = None
+
+    def set(self, name, x, y, style='-', keep=None):
+        '''Data of line name, created with style the first time. With keep only the latest
+        keep lines stay, the oldest one is reused for a new name'''
+        if name not in self.series:
+            if keep is not None and len(self.order) >= keep:
+                old = self.order.pop(0)
+                line = self.series.pop(old)[2]
+            else:
+                line = self.axes.plot([], [], style, animated=True)[0]
+            self.series[name] = [x, y, line]
+            self.order.append(name)
+        else:
+            self.series[name][:2] = x, y
+        self.dirty = True
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def refresh(self):
+        '''Timer: bring the lines up to date, blit if the limits still fit'''
+        if not self.dirty:
+            self.timer.stop()
+            return
+        self.dirty = False
+        (x0, x1), (y0, y1) = sorted(self.axes.get_xlim()), sorted(self.axes.get_ylim())
+        rescale = self.background is None
+        for x, y, line in self.series.values():
+            n = min(len(x), len(y)) # lists may still be growing
+            x, y = decimate(np.asarray(x[:n], dtype=float), np.asarray(y[:n], dtype=float), self.points)
+            line.set_data(x, y)
+            finite = np.isfinite(x) & np.isfinite(y)
+            if finite.any():
+                x, y = x[finite], y[finite]
+                rescale = rescale or x.min() < x0 or x.max() > x1 or y.min() < y0 or y.max() > y1
+        if rescale:
+            self.axes.relim()
+            self.axes.autoscale_view()
+            for get, put in ((self.axes.get_xlim, self.axes.set_xlim), (self.axes.get_ylim, self.axes.set_ylim)):
+                low, high = get()
+                put(low - self.headroom*(high - low), high + self.headroom*(high - low)) # fewer rescales for growing data
+            self.canvas.draw() # new background, drawn() adds the lines
+            return
+        self.canvas.restore_region(self.background)
+        self.blit()
+
+    def save(self, *args, **kwargs):
+        '''canvas.print_figure with the lines drawn like the rest of the figure'''
+        lines = [line for x, y, line in self.series.values()]
+        self.saving = True
+        for line in lines:
+            line.set_animated(False)
+        try:
+            return self.printFigure(*args, **kwargs)
+        finally:
+            for line in lines:
+                line.set_animated(True)
+            self.saving = False
+            self.canvas.draw_idle() # background without the lines again
+
+    def drawn(self, event):
+        '''After every full draw (also resizes): cache the empty axes, then draw the lines'''
+        if self.saving: # file output, not the screen
+            return
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self.blit()
+
+    def blit(self):
+        for x, y, line in self.series.values():
+            self.axes.draw_artist(line)
+        self.canvas.blit(self.axes.bbox)
@@ -18,76 +18,127 @@ Copyright © 2005 Florent Rougon, 2006 Darren Dale
 
 __version__ = "1.0.0"
 
-from PyQt4.QtGui import QSizePolicy
+from PyQt4.QtGui import QSizePolicy, QVBoxLayout, QWidget
 from PyQt4.QtCore import QSize
 
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as Canvas
-from matplotlib.figure import Figure
+_Canvas = None # matplotlib canvas class, made on first use
 
-from matplotlib import rcParams
-rcParams['font.size'] = 9
 
-
-class MatplotlibWidget(Canvas):
+def canvas_class():
+    """
+    The matplotlib canvas class. matplotlib and its Qt4 backend are imported
+    on the first call, not when the GUI module is loaded
     """
-    MatplotlibWidget inherits PyQt4.QtGui.QWidget
-    and matplotlib.backend_bases.FigureCanvasBase
+    global _Canvas
+    if _Canvas is not None:
+        return _Canvas
+
+    from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as Canvas
+    from matplotlib.figure import Figure
+
+    from matplotlib import rcParams
+    rcParams['font.size'] = 9
+
+
+    class MatplotlibCanvas(Canvas):
+        """
+        MatplotlibCanvas inherits PyQt4.QtGui.QWidget
+        and matplotlib.backend_bases.FigureCanvasBase
     
-    Options: option_name (default_value)
-    -------    
-    parent (None): parent widget
-    title (''): figure title
-    xlabel (''): X-axis label
-    ylabel (''): Y-axis label
-    xlim (None): X-axis limits ([min, max])
-    ylim (None): Y-axis limits ([min, max])
-    xscale ('linear'): X-axis scale
-    yscale ('linear'): Y-axis scale
-    width (4): width in inches
-    height (3): height in inches
-    dpi (100): resolution in dpi
-    hold (False): if False, figure will be cleared each time plot is called
+        Options: option_name (default_value)
+        -------    
+        parent (None): parent widget
+        title (''): figure title
+        xlabel (''): X-axis label
+        ylabel (''): Y-axis label
+        xlim (None): X-axis limits ([min, max])
+        ylim (None): Y-axis limits ([min, max])
+        xscale ('linear'): X-axis scale
+        yscale ('linear'): Y-axis scale
+        width (4): width in inches
+        height (3): height in inches
+        dpi (100): resolution in dpi
+        hold (False): if False, figure will be cleared each time plot is called
     
-    Widget attributes:
-    -----------------
-    figure: instance of matplotlib.figure.Figure
-    axes: figure axes
+        Widget attributes:
+        -----------------
+        figure: instance of matplotlib.figure.Figure
+        axes: figure axes
     
-    Example:
-    -------
-    self.widget = MatplotlibWidget(self, yscale='log', hold=True)
-    from numpy import linspace
-    x = linspace(-10, 10)
-    self.widget.axes.plot(x, x**2)
-    self.wdiget.axes.plot(x, x**3)
+        Example:
+        -------
+        self.widget = MatplotlibWidget(self, yscale='log', hold=True)
+        from numpy import linspace
+        x = linspace(-10, 10)
+        self.widget.axes.plot(x, x**2)
+        self.wdiget.axes.plot(x, x**3)
+        """
+        def __init__(self, parent=None, title='', xlabel='', ylabel='',
+                     xlim=None, ylim=None, xscale='linear', yscale='linear',
+                     width=4, height=3, dpi=100, hold=False):
+            self.figure = Figure(figsize=(width, height), dpi=dpi)
+            self.axes = self.figure.add_subplot(111)
+            self.axes.set_title(title)
+            self.axes.set_xlabel(xlabel)
+            self.axes.set_ylabel(ylabel)
+            if xscale is not None:
+                self.axes.set_xscale(xscale)
+            if yscale is not None:
+                self.axes.set_yscale(yscale)
+            if xlim is not None:
+                self.axes.set_xlim(*xlim)
+            if ylim is not None:
+                self.axes.set_ylim(*ylim)
+            self.axes.hold(hold)
+
+            Canvas.__init__(self, self.figure)
+            self.setParent(parent)
+
+            Canvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
+            Canvas.updateGeometry(self)
+
+        def sizeHint(self):
+            w, h = self.get_width_height()
+            return QSize(w, h)
+
+        def minimumSizeHint(self):
+            return QSize(10, 10)
+
+    _Canvas = MatplotlibCanvas
+    return _Canvas
+
+
+class MatplotlibWidget(QWidget):
+    """
+    Placeholder for the canvas so the window can be shown before matplotlib
+    is loaded. The canvas (MatplotlibCanvas, options as below) is created by
+    load() or by the first use of one of its attributes, eg figure, axes or
+    draw, which are passed through to it.
     """
-    def __init__(self, parent=None, title='', xlabel='', ylabel='',
-                 xlim=None, ylim=None, xscale='linear', yscale='linear',
-                 width=4, height=3, dpi=100, hold=False):
-        self.figure = Figure(figsize=(width, height), dpi=dpi)
-        self.axes = self.figure.add_subplot(111)
-        self.axes.set_title(title)
-        self.axes.set_xlabel(xlabel)
-        self.axes.set_ylabel(ylabel)
-        if xscale is not None:
-            self.axes.set_xscale(xscale)
-        if yscale is not None:
-            self.axes.set_yscale(yscale)
-        if xlim is not None:
-            self.axes.set_xlim(*xlim)
-        if ylim is not None:
-            self.axes.set_ylim(*ylim)
-        self.axes.hold(hold)
-
-        Canvas.__init__(self, self.figure)
-        self.setParent(parent)
-
-        Canvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
-        Canvas.updateGeometry(self)
+    def __init__(self, parent=None, **options):
+        QWidget.__init__(self, parent)
+        self.options = options
+        self.canvas = None
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.updateGeometry()
+
+    def load(self):
+        """Create the canvas (imports matplotlib the first time)"""
+        if self.canvas is None:
+            self.canvas = canvas_class()(self, **self.options)
+            self.layout().addWidget(self.canvas)
+        return self.canvas
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('canvas', 'options'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
 
     def sizeHint(self):
-        w, h = self.get_width_height()
-        return QSize(w, h)
+        dpi = self.options.get('dpi', 100)
+        return QSize(self.options.get('width', 4)*dpi, self.options.get('height', 3)*dpi)
 
     def minimumSizeHint(self):
         return QSize(10, 10)
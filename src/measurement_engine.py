@@ -10,6 +10,13 @@ import random
 import numpy as np
 
 from src.k2400_control import * # conductivity engine controls keithley
+import src.comm_stats as comm_stats
+from src.scheduler import DeadlineClock
+from src.parameters import BLANK # entries a list parameter may leave empty
+
+def calc_conductivity(i, v, width, thickness):
+    '''Conductivity in S/m from current, voltage, channel width [um] and film thickness [nm]'''
+    return (i/v)*((float(width)*(1e-6))/(20e-3*(float(thickness)*1e-9))) # finger length * film thickness!!
 
 class Conductivity_Engine():
     '''Routine for fixed-voltage measurements and IV sweep'''
@@ -17,7 +24,8 @@ class Conductivity_Engine():
         pass
 
     def connect2Keith(self):
-        smu, rm = k2400.connect_SMU(self.user_parameters)
+        smu, rm = smuSessions.get(self.user_parameters) # reuses the open connection
+        smu.stats = comm_stats.start(smu.name) if self.user_parameters.value['commStats'] else comm_stats.stop(smu.name)
         return smu, rm	
 
     def measure(self, smu):
@@ -25,7 +33,7 @@ class Conductivity_Engine():
         width = self.user_parameters.value['OFET_width']
         thickness = self.user_parameters.value['OFET_thickness']
         number = self.user_parameters.value['OFET_no']
-        name = str('OFET'+'_'+width+'_'+number)
+        name = 'OFET_%s_%s'%(width, number)
         self.ConductivityConsole.emit('Measuring: '+name)
         
         # IV Sweep for Ohmic injection check
@@ -38,7 +46,15 @@ class Conductivity_Engine():
             self.IVConsole.emit('Measurement aborted')
             return
 
-        v, i = smu.measIVsweep(self.user_parameters.value)
+        pars = self.user_parameters.value
+        sweepList = pars['sweepList']
+        if sweepList is not None:
+            v, i = smu.measListSweep(pars, [float(x) for x in sweepList.split(',') if x.strip() not in BLANK]) # custom bias program
+        elif pars['dualSweep'] or pars['sweepSpacing'] != 'LIN':
+            levels = sweep_levels(pars['initialV'], pars['finalV'], pars['stepSize'], pars['sweepSpacing'], pars['dualSweep'])
+            v, i = smu.measListSweep(pars, levels) # forward and reverse in one go for hysteresis
+        else:
+            v, i = smu.measIVsweep(pars)
         data = v, i
              
         self.IVConsole.emit('Voltage [V] \t Current [A]')
@@ -60,8 +76,31 @@ class Conductivity_Engine():
         current = []
         voltage =[]
         conductivity = []
+        if self.user_parameters.value['nRepeats'] is None: # IV sweep only
+            print('No fixed voltage conductivity measurement.')
+            return
+        nRepeats = int(self.user_parameters.value['nRepeats'])
+        if self.user_parameters.value['pipelined'] and 2*nRepeats <= BUFFER_SIZE:
+            # one trigger model run, only readings come back
+            def newData(t, v, i):
+                for n in range(len(sample), len(i)):
+                    oo = calc_conductivity(i[n], v[n], width, thickness)
+                    sample.append(int(n))
+                    voltage.append(float(v[n]))
+                    current.append(float(i[n]))
+                    conductivity.append(float(oo))
+                    self.ConductivityConsole.emit('%s \t %.4g \t %.2e' % ((n+1), i[n], oo*1e-2))
+                    self.progressBar.emit(20+(n+1)*(80/nRepeats))
+            t, v, i = smu.measConductivityPipelined(self.user_parameters.value, nRepeats, newData, lambda: self._flag)
+            newData(t, v, i) # readings after the last live update
+            if self._flag:
+                self.signalStatus.emit('Stopped.')
+                self.ConductivityConsole.emit('Measurement aborted')
+            data2 = sample, voltage, current, conductivity
+            self.endCondData.emit(data2)
+            return
         try:
-            for n in range((int(self.user_parameters.value['nRepeats']))):
+            for n in range(nRepeats):
                 if self._flag: 
                     self.signalStatus.emit('Stopped.')
                     self.ConductivityConsole.emit('Measurement aborted')            
@@ -70,7 +109,7 @@ class Conductivity_Engine():
                 voltage.append(float(vv))
                 sample.append(int(n))
                 # conductivity calculation
-                oo = (ii/vv)*((float(width)*(1e-6))/(20e-3*(float(thickness)*1e-9))) # finger length * film thickness!!
+                oo = calc_conductivity(ii, vv, width, thickness)
                 conductivity.append(float(oo))
                 self.ConductivityConsole.emit('%s \t %.4g \t %.2e' % ((n+1), ii, oo*1e-2))
                 self.progressBar.emit(20+(n+1)*(80/(int(self.user_parameters.value['nRepeats']))))
@@ -98,7 +137,8 @@ class IV_Engine():
         pass
         
     def connect2Keith(self):
-        smu, rm = k2400.connect_SMU(self.user_parameters)
+        smu, rm = smuSessions.get(self.user_parameters) # reuses the open connection
+        smu.stats = comm_stats.start(smu.name) if self.user_parameters.value['commStats'] else comm_stats.stop(smu.name)
         #print (smu.query('*IDN?'))
         return smu, rm
     
@@ -110,19 +150,36 @@ class IV_Engine():
         v = []
         i = []
         t = []
-        for n in range ((int(self.user_parameters.value['nRepeats']))):
+        nRepeats = int(self.user_parameters.value['nRepeats'])
+        if self.user_parameters.value['bufferedV'] and nRepeats <= BUFFER_SIZE:
+            # readings timed and stored by the instrument, fetched in bulk
+            def newData(t, v, i):
+                self.newfixedVDataPoint.emit((t, v, i)) # for live update
+            t, v, i = smu.measVbuffered(self.user_parameters.value, nRepeats, float(self.user_parameters.value['pauseTime']), newData, lambda: self._flag)
+            newData(t, v, i) # readings after the last live update
+            if self._flag:
+                self.signalStatus.emit('Stopped.')
+                self.KeithleyConsole.emit('Measurement aborted')
+            data = t, i
+            self.endData.emit(data)
+            return v, i
+        clock = DeadlineClock(float(self.user_parameters.value['pauseTime']), lambda: self._flag).start() #Time between measurements
+        for n in range (nRepeats):
             if self._flag: 
                 self.signalStatus.emit('Stopped.')
                 self.KeithleyConsole.emit('Measurement aborted')
                 return v, i
-            vv, ii = smu.measV(self.user_parameters.value)
+            tt, (vv, ii) = clock.stamp(lambda: smu.measV(self.user_parameters.value))
             self.KeithleyConsole.emit(n, '\t', vv, '\t', '%.4g' %ii)
             v.append(float(vv))
             i.append(float(ii))
-            t.append(int(n))
+            t.append(tt)
             data = t, v, i
             self.newfixedVDataPoint.emit(data) # for live update
-            time.sleep(float(self.user_parameters.value['pauseTime'])) #Time between measurements
+            if n < nRepeats - 1:
+                clock.wait()
+        if clock.missed:
+            self.KeithleyConsole.emit('%d measurement deadlines missed, pauseTime is shorter than a reading'%clock.missed)
         data = t, i
         self.endData.emit(data)
         return v, i
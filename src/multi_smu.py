@@ -0,0 +1,246 @@
+'''
+Conductivity measurements of a list of devices, eg the 16 OFETs of a chip, on one or
+several Keithleys. Every SMU gets its own I/O thread running Conductivity_Engine.measure
+for one device after another on its open session, so a chip takes (devices / SMUs) device
+times. Results stream per device, are saved while the next device is measured and merge
+into one record for the chip.
+'''
+
+import queue
+import threading
+import time
+import numpy as np
+
+from src.k2400_control import smuSessions
+import src.comm_stats as comm_stats
+from src.measurement_engine import Conductivity_Engine
+from src.events import EngineWorker
+
+CHIP_COLUMNS = ('OFET_width', 'OFET_no', 'Sample', 'Voltage', 'Current', 'Conductivity')
+OFET_POSITIONS = tuple('%s_%d'%(width, n) for width in ('20', '10', '5', '2p5') for n in range(1, 5)) # OFET_devices all
+
+
+def parse_list(value):
+    '''Comma separated parameter as list of stripped strings, empty for blank/NA'''
+    value = str(value).strip()
+    if value in ('', 'nan', 'NA', 'None'):
+        return []
+    return [x.strip() for x in value.split(',') if x.strip()]
+
+def parse_devices(value):
+    '''Devices in OFET_devices ('20_1,2p5_2', or all for the 16 positions of a chip) as parameter dicts'''
+    names = parse_list(value)
+    if [name.lower() for name in names] == ['all']:
+        names = OFET_POSITIONS
+    devices = []
+    for device in names:
+        width, number = device.rsplit('_', 1)
+        devices.append({'OFET_width': width.replace('p', '.'), 'OFET_no': number})
+    return devices
+
+def device_name(device):
+    return 'OFET_%s_%s'%(device['OFET_width'], device['OFET_no'])
+
+def save_device(user_parameters, device, result):
+    '''Write the IV sweep and conductivity files of one device, as a single device run does'''
+    import src.Utilities as Utilities #only needed when saving
+    pars = user_parameters.replace(dict((key, value) for key, value in device.items() if key != 'smu'))
+    if 'IV' in result:
+        sweep = pars.replace({'setup': 'IV_sweep', 'x_descript': 'Voltage', 'y_descript': 'Current'},
+                             {'x_descript': '/V', 'y_descript': '/A'})
+        Utilities.save_to_file(sweep.frame(), *result['IV'])
+    if 'conductivity' in result:
+        repeats = pars.replace({'setup': 'Conductivity', 'x_descript': 'Sample', 'y_descript': 'Voltage, Current, Conductivity'},
+                               {'x_descript': '', 'y_descript': '/(V, A, S/m)'})
+        Utilities.conductivity_save_to_file(repeats.frame(), *result['conductivity'])
+
+
+class SwitchMatrix():
+    '''Stand-in for a switch matrix that connects an SMU to one device at a time. select() is
+    called on the SMU thread before each device is measured. This one has no hardware, it
+    only waits settleTime; subclass it and override route() for a real matrix.'''
+
+    def __init__(self, settleTime=0.0):
+        self.settleTime = settleTime
+        self.selected = {} # SMU index: name of the connected device
+        self.lock = threading.Lock() # one matrix is shared by all SMUs
+
+    def route(self, n, device):
+        '''Connect SMU n to device'''
+        pass
+
+    def select(self, n, device, name):
+        with self.lock:
+            self.route(n, device)
+            self.selected[n] = name
+        time.sleep(self.settleTime)
+
+
+class MultiSMUExecutor():
+    '''Measure devices (dicts of parameter overrides, at least OFET_width and OFET_no) on
+    SMUs (dicts of connection overrides, eg serAd). A device with an 'smu' index is measured on
+    that SMU only, the others go to whichever SMU is free first (switch matrix).
+    saveDevice(device, result) is called on a separate thread once a device is done, so
+    files are written while the next device is measured.'''
+
+    def __init__(self, user_parameters, smus, devices, switch=None, saveDevice=None):
+        self.user_parameters = user_parameters
+        self.smus = smus
+        self.devices = devices
+        self.switch = SwitchMatrix() if switch is None else switch
+        self.saveDevice = saveDevice
+        self.saving = queue.Queue() # (device, name) of finished devices, None to stop
+        self.names = [device_name(device) for device in devices]
+        self.streams = dict((name, queue.Queue()) for name in self.names) # (kind, data) per device
+        self.workers = {} # device name: EngineWorker while it is measured
+        self.aborted = set()
+        self.results = dict((name, {}) for name in self.names)
+        self.lock = threading.Lock()
+
+    def fromParameters(user_parameters):
+        '''Executor for the serial addresses in smuAddresses (the connection parameters if none)
+        and the devices in OFET_devices, saving each device's files if saveData is set'''
+        smus = [{'serAd': address} for address in parse_list(user_parameters.value['smuAddresses'])] or [{}]
+        saveDevice = None
+        if user_parameters.value['saveData']:
+            saveDevice = lambda device, result: save_device(user_parameters, device, result)
+        return MultiSMUExecutor(user_parameters, smus, parse_devices(user_parameters.value['OFET_devices']), saveDevice=saveDevice)
+
+    def abort(self, name=None):
+        '''Stop one device (or all of them if name is None)'''
+        with self.lock:
+            names = self.names if name is None else [name]
+            self.aborted.update(names)
+            for n in names:
+                if n in self.workers:
+                    self.workers[n].stopWork()
+
+    def run(self, newResult=None):
+        '''Measure every device, newResult(name, kind, data) is called from the SMU threads
+        as results arrive. Returns the merged run record, see merged()'''
+        shared = queue.Queue()
+        own = [queue.Queue() for smu in self.smus]
+        for device, name in zip(self.devices, self.names):
+            if 'smu' in device:
+                own[int(device['smu'])].put((device, name))
+            else:
+                shared.put((device, name))
+        threads = [threading.Thread(target=self._runSMU, args=(n, own[n], shared, newResult), name='SMU %s'%n)
+                   for n in range(len(self.smus))]
+        saver = threading.Thread(target=self._save, name='Saving')
+        saver.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._fail(shared, 'no SMU available', newResult) # left over if every SMU failed to open
+        self.saving.put(None)
+        saver.join()
+        return self.merged()
+
+    def _runSMU(self, n, own, shared, newResult):
+        '''I/O thread of SMU n'''
+        try:
+            smu, rm = smuSessions.get(self.user_parameters.replace(self.smus[n]))
+            smu.stats = comm_stats.start(smu.name) if self.user_parameters.value['commStats'] else None
+        except Exception as error:
+            print('### SMU %s not available: %s ###'%(self.smus[n], error))
+            self._fail(own, 'SMU %s not available: %s'%(self.smus[n], error), newResult) # shared devices go to the other SMUs
+            return
+        for devices in (own, shared):
+            while True:
+                try:
+                    device, name = devices.get_nowait()
+                except queue.Empty:
+                    break
+                self.switch.select(n, device, name)
+                self._measure(smu, device, name, newResult)
+                if self.saveDevice is not None and self.results[name]:
+                    self.saving.put((device, name))
+
+    def _fail(self, devices, error, newResult):
+        '''Finish the devices still in queue devices with error, without measuring them'''
+        while True:
+            try:
+                device, name = devices.get_nowait()
+            except queue.Empty:
+                return
+            self.streams[name].put(('error', error))
+            if newResult is not None:
+                newResult(name, 'error', error)
+            self.streams[name].put(('done', None))
+
+    def _save(self):
+        '''Saving thread: saveDevice for every finished device'''
+        while True:
+            item = self.saving.get()
+            if item is None:
+                return
+            device, name = item
+            try:
+                self.saveDevice(device, self.results[name])
+            except Exception as error:
+                print('### %s not saved: %s ###'%(name, error))
+
+    def _measure(self, smu, device, name, newResult):
+        '''One device: Conductivity_Engine.measure on a plain worker whose signals feed the stream'''
+        changes = dict((key, value) for key, value in device.items() if key != 'smu')
+        worker = EngineWorker(self.user_parameters.replace(changes))
+        stream = self.streams[name]
+        def forward(kind):
+            def slot(*data):
+                data = data[0] if len(data) == 1 else data
+                if kind in ('IV', 'conductivity'):
+                    self.results[name][kind] = data
+                stream.put((kind, data))
+                if newResult is not None:
+                    newResult(name, kind, data)
+            return slot
+        worker.newIVData.connect(forward('IV'))
+        worker.endCondData.connect(forward('conductivity'))
+        worker.ConductivityConsole.connect(forward('console'))
+        worker.IVConsole.connect(forward('console'))
+        worker.signalStatus.connect(forward('status'))
+        with self.lock:
+            if name in self.aborted:
+                stream.put(('status', 'Aborted'))
+                stream.put(('done', None))
+                return
+            self.workers[name] = worker
+        try:
+            Conductivity_Engine.measure(worker, smu)
+        except Exception as error:
+            stream.put(('error', error))
+            if newResult is not None:
+                newResult(name, 'error', error)
+        with self.lock:
+            del self.workers[name]
+        stream.put(('done', None))
+
+    def summary(self):
+        '''[(name, samples, mean and standard deviation of the conductivity in S/m)] of the
+        devices measured'''
+        rows = []
+        for name in self.names:
+            if len(self.results[name].get('conductivity', ((),)*4)[3]):
+                conductivity = np.array(self.results[name]['conductivity'][3], dtype=float)
+                rows.append((name, len(conductivity), np.mean(conductivity), np.std(conductivity)))
+        return rows
+
+    def merged(self):
+        '''One record for the chip: CHIP_COLUMNS as equal length arrays, plus 'IV' with
+        the (v, i) sweep of every device'''
+        columns = dict((key, []) for key in CHIP_COLUMNS)
+        for device, name in zip(self.devices, self.names):
+            if 'conductivity' not in self.results[name]:
+                continue
+            sample, voltage, current, conductivity = self.results[name]['conductivity']
+            columns['OFET_width'] += [float(device['OFET_width'])]*len(sample)
+            columns['OFET_no'] += [int(device['OFET_no'])]*len(sample)
+            columns['Sample'] += list(sample)
+            columns['Voltage'] += list(voltage)
+            columns['Current'] += list(current)
+            columns['Conductivity'] += list(conductivity)
+        record = dict((key, np.array(value, dtype=float)) for key, value in columns.items())
+        record['IV'] = dict((name, self.results[name]['IV']) for name in self.names if 'IV' in self.results[name])
+        return record
@@ -0,0 +1,104 @@
+'''
+Read-only, typed snapshot of the measurement parameters. It is built once from the GUI
+inputs (or df_measurement.csv) and handed to the workers when a run starts. value[key] gives
+the parsed value: flags are bools, numbers are floats/ints, blank entries are None.
+'''
+
+import csv
+import math
+import threading
+from types import MappingProxyType
+
+FLAGS = ('takefixedV', 'takeIVsweep', 'dualSweep', 'bufferedV', 'pipelined', 'simSerial', 'commStats',
+         'QCM1', 'QCM2', 'QCM3', 'QCM4', 'saveData', 'insitu')
+INTEGERS = ('nRepeats', 'compliance', 'simSeed', 'baudR', 'insituChannel')
+FLOATS = ('OFET_thickness', 'initialV', 'finalV', 'stepSize', 'holdTime', 'fixedV', 'pauseTime',
+          'integrationTime', 'simResistance', 'simNonlinearity', 'simNoise', 'simSpeed',
+          'QCM_sampleTime', 'QCM_targetWarning')
+NUMBER_LISTS = ('QCM_target', 'sweepList') # comma separated numbers (blank entries allowed), kept as text
+BLANK = ('', 'nan', 'NA', 'None')
+COLUMNS = ('value', 'units', 'fmf_name', 'fmf_category')
+CSV_TITLE = ' --- Insitu ECHO meas template for data-frame used to store inputs and write file header - change at your own risk---,,,,'
+
+def parse(key, value):
+    '''Typed value of parameter key from its csv or widget form'''
+    if value is None or (isinstance(value, float) and math.isnan(value)) or str(value).strip() in BLANK:
+        return None
+    if key in FLAGS:
+        return value if isinstance(value, bool) else str(value).strip() == 'True'
+    try:
+        if key in INTEGERS:
+            return int(float(value))
+        if key in FLOATS:
+            return float(value)
+    except ValueError:
+        raise ValueError('%s must be a number, not %r'%(key, value))
+    if key in NUMBER_LISTS:
+        try:
+            [float(entry) for entry in str(value).split(',') if entry.strip() not in BLANK]
+        except ValueError:
+            raise ValueError('%s must be numbers separated by commas, not %r'%(key, value))
+    return str(value)
+
+def csv_lines(path):
+    '''Rows of a parameter file below its title and column names, padded to 5 entries'''
+    with open(path, newline='') as f:
+        lines = list(csv.reader(f))[2:]
+    return [(line + ['']*5)[:5] for line in lines if line and line[0]]
+
+
+class MeasurementParameters():
+    '''Immutable parameter set. rows keeps key, value (as entered), units, fmf_name and
+    fmf_category of every parameter for file headers, value maps key to the typed value'''
+
+    def __init__(self, rows):
+        rows = tuple(tuple(row) for row in rows)
+        object.__setattr__(self, 'rows', rows)
+        object.__setattr__(self, 'value', MappingProxyType(dict((row[0], parse(row[0], row[1])) for row in rows)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('MeasurementParameters are read only, use replace()')
+
+    def fromFrame(frame):
+        '''Snapshot of a parameter DataFrame (index key, columns as in df_template.csv)'''
+        return MeasurementParameters((key,) + tuple(row[c] for c in COLUMNS) for key, row in frame.iterrows())
+
+    def fromCSV(path='src/df_measurement.csv'):
+        '''Snapshot of a parameter file, without pandas'''
+        return MeasurementParameters(csv_lines(path))
+
+    def keys(path='src/df_measurement.csv'):
+        '''The keys of a parameter file in order, its values are not parsed (df_template.csv
+        has units as placeholders)'''
+        return [line[0] for line in csv_lines(path)]
+
+    def replace(self, changes, units={}):
+        '''New snapshot with the values in the dict changes replaced (or added), and the
+        units of existing keys in the dict units'''
+        rows = [(row[0], changes[row[0]]) + row[2:] if row[0] in changes else row for row in self.rows]
+        rows = [row[:2] + (units[row[0]],) + row[3:] if row[0] in units else row for row in rows]
+        known = set(row[0] for row in self.rows)
+        rows += [(key, value, '', '', '') for key, value in changes.items() if key not in known]
+        return MeasurementParameters(rows)
+
+    def frame(self):
+        '''The parameters as a DataFrame, eg for Utilities.pandas_2fmfHeader'''
+        import pandas as pd # only needed for saving
+        frame = pd.DataFrame([row[1:] for row in self.rows], index=[row[0] for row in self.rows], columns=COLUMNS)
+        frame.index.name = 'key'
+        return frame
+
+    def save(self, path='src/df_measurement.csv'):
+        '''Write the parameters in the df_measurement.csv layout'''
+        with open(path, 'w', newline='') as f:
+            f.write(CSV_TITLE + '\n')
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(('key',) + COLUMNS)
+            for row in self.rows:
+                writer.writerow(tuple(' ' if v is None or str(v) == 'nan' else v for v in row))
+
+    def saveInBackground(self, path='src/df_measurement.csv'):
+        '''save() on a separate thread so starting a run does not wait for the disk'''
+        thread = threading.Thread(target=self.save, args=(path,), name='Parameter file')
+        thread.start()
+        return thread
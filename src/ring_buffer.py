@@ -0,0 +1,71 @@
+'''
+Fixed capacity sample storage for long acquisitions. The latest samples stay in a
+preallocated NumPy array, older ones are spilled to a binary file in chunks, so memory
+and the cost per sample do not grow with the length of the run.
+'''
+
+import os
+import tempfile
+import numpy as np
+
+class RingBuffer():
+    '''Rows of dtype, the last capacity in memory. With spill every row also goes to a file
+    (raw dtype records) chunk rows at a time, so all() can give back the whole run.
+    Rows are numbered from 0 in the order they were appended.'''
+
+    def __init__(self, dtype, capacity=4096, chunk=256, spill=True, directory=None):
+        self.dtype = np.dtype(dtype)
+        self.capacity = int(capacity)
+        self.chunk = min(int(chunk), self.capacity)
+        self.data = np.zeros(self.capacity, dtype=self.dtype)
+        self.count = 0 # rows appended so far
+        self.spilled = 0 # rows written to the spill file
+        self.spillFile = None
+        if spill:
+            handle, self.spillFile = tempfile.mkstemp(suffix='.ring', dir=directory)
+            os.close(handle)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, row):
+        '''Add one row (a record of dtype or a tuple of its fields)'''
+        self.data[self.count % self.capacity] = row
+        self.count += 1
+        if self.spillFile is not None and self.count - self.spilled >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        '''Write the rows not yet spilled to the file'''
+        if self.spillFile is None or self.spilled == self.count:
+            return
+        with open(self.spillFile, 'ab') as f:
+            self.since(self.spilled).tofile(f)
+        self.spilled = self.count
+
+    def since(self, index):
+        '''Rows index, index + 1, ... that are still in memory, oldest first'''
+        start = max(index, self.count - self.capacity, 0)
+        if start >= self.count:
+            return np.zeros(0, dtype=self.dtype)
+        first, last = start % self.capacity, (self.count - 1) % self.capacity + 1
+        if first < last:
+            return self.data[first:last].copy()
+        return np.concatenate((self.data[first:], self.data[:last]))
+
+    def latest(self, n=None):
+        '''Last n rows in memory (all of them if n is None), oldest first'''
+        return self.since(0 if n is None else self.count - n)
+
+    def all(self):
+        '''Every row of the run: the spill file plus the rows not written yet'''
+        if self.spillFile is None:
+            return self.latest()
+        self.flush()
+        return np.fromfile(self.spillFile, dtype=self.dtype)
+
+    def close(self):
+        '''Delete the spill file'''
+        if self.spillFile is not None and os.path.exists(self.spillFile):
+            os.remove(self.spillFile)
+        self.spillFile = None
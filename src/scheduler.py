@@ -0,0 +1,53 @@
+'''
+Fixed cadence sampling on the monotonic clock. Deadlines are start + n*interval, so
+the time spent on I/O and plotting does not add up to drift, and late samples are counted.
+'''
+
+import math
+import time
+
+class DeadlineClock():
+    '''Sample clock for acquisition loops: call start() once, stamp each reading with now()
+    and wait() for the next deadline. A deadline that has already passed is skipped and
+    counted in missed, the following ones stay on the original grid.'''
+
+    def __init__(self, interval, abort=None, poll=0.1):
+        self.interval = float(interval)
+        self.abort = abort # callable returning True to stop waiting
+        self.poll = poll # s between abort checks while waiting
+        self.started = None
+        self.deadline = 0 # number of the next deadline
+        self.missed = 0
+
+    def start(self, started=None):
+        '''Start now, or at the monotonic time started to share a timebase with another clock'''
+        self.started = time.monotonic() if started is None else started
+        self.deadline = 0
+        self.missed = 0
+        return self
+
+    def now(self):
+        '''s since start'''
+        return time.monotonic() - self.started
+
+    def stamp(self, read):
+        '''Call read() and return (midpoint of the call in s since start, its result)'''
+        before = self.now()
+        result = read()
+        return 0.5*(before + self.now()), result
+
+    def wait(self):
+        '''Sleep until the next deadline. Returns False if abort() became True meanwhile'''
+        self.deadline += 1
+        late = self.now() - self.deadline*self.interval
+        if late > 0:
+            skipped = int(math.ceil(late/self.interval)) if self.interval > 0 else 0
+            self.missed += skipped
+            self.deadline += skipped
+        while True:
+            remaining = self.deadline*self.interval - self.now()
+            if self.abort is not None and self.abort():
+                return False
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, self.poll))
@@ -0,0 +1,62 @@
+'''
+Import cost of the modules the program loads, each measured in a fresh interpreter with
+python -X importtime. Run from the program folder:
+
+    python3 -m src.startup_benchmark [repeats] [module ...]
+
+Without modules it times the heavy dependencies one by one, then what main_program itself
+loads at startup, broken down by module. The lowest of repeats runs is reported, the first
+run after a reboot shows the cold disk cache cost.
+'''
+
+import os
+import subprocess
+import sys
+
+MODULES = ('PyQt4.QtGui', 'numpy', 'pandas', 'matplotlib.backends.backend_qt4agg', 'visa', 'serial',
+           'src.transistor_tools_GUI', 'src.Utilities', 'src.measurement_engine', 'src.inficon_engine',
+           'src.insitu_engine', 'main_program')
+
+def import_times(module):
+    '''[(depth, name, self us, cumulative us)] for `import module` in a new interpreter,
+    None if it can not be imported'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s'%module],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if result.returncode:
+        return None
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1)//2
+        times.append((depth, name.strip(), int(own), int(cumulative)))
+    return times
+
+def total(times):
+    '''Cost of the whole import in s: the top level entries'''
+    return sum(t[3] for t in times if t[0] == 0)*1e-6
+
+def best(module, repeats):
+    '''import_times of the fastest of repeats runs'''
+    runs = [t for t in (import_times(module) for n in range(repeats)) if t is not None]
+    return min(runs, key=total) if runs else None
+
+def benchmark(modules=MODULES, repeats=3):
+    '''Print the import cost of each module, and for main_program what it loads directly'''
+    print('%-40s %10s'%('module', 'import [s]'))
+    for module in modules:
+        times = best(module, repeats)
+        print('%-40s %10s'%(module, 'failed' if times is None else '%.3f'%total(times)))
+        if module == 'main_program' and times is not None:
+            print('\nmain_program startup imports:')
+            loaded = [t for t in times if t[0] == 1]
+            for depth, name, own, cumulative in sorted(loaded, key=lambda t: -t[3]):
+                if cumulative >= 1000: # skip the sub-millisecond ones
+                    print('  %-38s %10.3f'%(name, cumulative*1e-6))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    repeats = int(args.pop(0)) if args and args[0].isdigit() else 3
+    benchmark(args or MODULES, repeats)
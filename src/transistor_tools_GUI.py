@@ -191,6 +191,28 @@ class Ui_MainWindow(object):
         self.label_32.setObjectName(_fromUtf8("label_32"))
         self.gridLayout.addWidget(self.label_32, 0, 1, 1, 1)
         self.verticalLayout_11.addLayout(self.gridLayout)
+        self.gridLayoutWidget_sweep = QtGui.QWidget(self.page_IVmeas)
+        self.gridLayoutWidget_sweep.setGeometry(QtCore.QRect(20, 480, 421, 61))
+        self.gridLayoutWidget_sweep.setObjectName(_fromUtf8("gridLayoutWidget_sweep"))
+        self.gridLayout_sweep = QtGui.QGridLayout(self.gridLayoutWidget_sweep)
+        self.gridLayout_sweep.setObjectName(_fromUtf8("gridLayout_sweep"))
+        self.checkBox_dualSweep = QtGui.QCheckBox(self.gridLayoutWidget_sweep)
+        self.checkBox_dualSweep.setObjectName(_fromUtf8("checkBox_dualSweep"))
+        self.gridLayout_sweep.addWidget(self.checkBox_dualSweep, 0, 0, 1, 1)
+        self.label_35 = QtGui.QLabel(self.gridLayoutWidget_sweep)
+        self.label_35.setObjectName(_fromUtf8("label_35"))
+        self.gridLayout_sweep.addWidget(self.label_35, 0, 1, 1, 1)
+        self.comboBox_sweepSpacing = QtGui.QComboBox(self.gridLayoutWidget_sweep)
+        self.comboBox_sweepSpacing.setObjectName(_fromUtf8("comboBox_sweepSpacing"))
+        self.comboBox_sweepSpacing.addItem(_fromUtf8(""))
+        self.comboBox_sweepSpacing.addItem(_fromUtf8(""))
+        self.gridLayout_sweep.addWidget(self.comboBox_sweepSpacing, 0, 2, 1, 1)
+        self.label_36 = QtGui.QLabel(self.gridLayoutWidget_sweep)
+        self.label_36.setObjectName(_fromUtf8("label_36"))
+        self.gridLayout_sweep.addWidget(self.label_36, 1, 0, 1, 1)
+        self.lineEdit_sweepList = QtGui.QLineEdit(self.gridLayoutWidget_sweep)
+        self.lineEdit_sweepList.setObjectName(_fromUtf8("lineEdit_sweepList"))
+        self.gridLayout_sweep.addWidget(self.lineEdit_sweepList, 1, 1, 1, 2)
         self.stackedWidget.addWidget(self.page_IVmeas)
         self.page_keithley = QtGui.QWidget()
         self.page_keithley.setObjectName(_fromUtf8("page_keithley"))
@@ -234,6 +256,7 @@ class Ui_MainWindow(object):
         self.comboBox.addItem(_fromUtf8(""))
         self.comboBox.addItem(_fromUtf8(""))
         self.comboBox.addItem(_fromUtf8(""))
+        self.comboBox.addItem(_fromUtf8(""))
         self.gridLayout_5.addWidget(self.comboBox, 0, 1, 1, 1)
         self.comboBox_4 = QtGui.QComboBox(self.verticalLayoutWidget_6)
         self.comboBox_4.setObjectName(_fromUtf8("comboBox_4"))
@@ -328,7 +351,7 @@ class Ui_MainWindow(object):
         self.gridLayout_9.addWidget(self.checkBoxQCM4, 3, 1, 1, 1)
         self.verticalLayout_8.addLayout(self.gridLayout_9)
         self.gridLayoutWidget_2 = QtGui.QWidget(self.page_deposition)
-        self.gridLayoutWidget_2.setGeometry(QtCore.QRect(20, 220, 421, 80))
+        self.gridLayoutWidget_2.setGeometry(QtCore.QRect(20, 220, 421, 190))
         self.gridLayoutWidget_2.setObjectName(_fromUtf8("gridLayoutWidget_2"))
         self.gridLayout_8 = QtGui.QGridLayout(self.gridLayoutWidget_2)
         self.gridLayout_8.setObjectName(_fromUtf8("gridLayout_8"))
@@ -341,6 +364,29 @@ class Ui_MainWindow(object):
         self.doubleSpinBox_5.setProperty("value", 1.0)
         self.doubleSpinBox_5.setObjectName(_fromUtf8("doubleSpinBox_5"))
         self.gridLayout_8.addWidget(self.doubleSpinBox_5, 0, 1, 1, 1)
+        self.label_33 = QtGui.QLabel(self.gridLayoutWidget_2)
+        self.label_33.setObjectName(_fromUtf8("label_33"))
+        self.gridLayout_8.addWidget(self.label_33, 1, 0, 1, 1)
+        self.lineEdit_QCM_target = QtGui.QLineEdit(self.gridLayoutWidget_2)
+        self.lineEdit_QCM_target.setObjectName(_fromUtf8("lineEdit_QCM_target"))
+        self.gridLayout_8.addWidget(self.lineEdit_QCM_target, 1, 1, 1, 1)
+        self.label_34 = QtGui.QLabel(self.gridLayoutWidget_2)
+        self.label_34.setObjectName(_fromUtf8("label_34"))
+        self.gridLayout_8.addWidget(self.label_34, 2, 0, 1, 1)
+        self.doubleSpinBox_QCM_targetWarning = QtGui.QDoubleSpinBox(self.gridLayoutWidget_2)
+        self.doubleSpinBox_QCM_targetWarning.setDecimals(0)
+        self.doubleSpinBox_QCM_targetWarning.setMaximum(3600.0)
+        self.doubleSpinBox_QCM_targetWarning.setProperty("value", 30.0)
+        self.doubleSpinBox_QCM_targetWarning.setObjectName(_fromUtf8("doubleSpinBox_QCM_targetWarning"))
+        self.gridLayout_8.addWidget(self.doubleSpinBox_QCM_targetWarning, 2, 1, 1, 1)
+        self.checkBox_insitu = QtGui.QCheckBox(self.gridLayoutWidget_2)
+        self.checkBox_insitu.setObjectName(_fromUtf8("checkBox_insitu"))
+        self.gridLayout_8.addWidget(self.checkBox_insitu, 3, 0, 1, 1)
+        self.spinBox_insituChannel = QtGui.QSpinBox(self.gridLayoutWidget_2)
+        self.spinBox_insituChannel.setMinimum(1)
+        self.spinBox_insituChannel.setMaximum(4)
+        self.spinBox_insituChannel.setObjectName(_fromUtf8("spinBox_insituChannel"))
+        self.gridLayout_8.addWidget(self.spinBox_insituChannel, 3, 1, 1, 1)
         self.stackedWidget.addWidget(self.page_deposition)
         self.Substrate_page = QtGui.QWidget()
         self.Substrate_page.setObjectName(_fromUtf8("Substrate_page"))
@@ -482,6 +528,9 @@ class Ui_MainWindow(object):
         self.pushButton_cond_stop = QtGui.QPushButton(self.horizontalLayoutWidget_3)
         self.pushButton_cond_stop.setObjectName(_fromUtf8("pushButton_cond_stop"))
         self.horizontalLayout_3.addWidget(self.pushButton_cond_stop)
+        self.lineEdit_OFET_devices = QtGui.QLineEdit(self.frame)
+        self.lineEdit_OFET_devices.setGeometry(QtCore.QRect(160, 610, 311, 25))
+        self.lineEdit_OFET_devices.setObjectName(_fromUtf8("lineEdit_OFET_devices"))
         self.OFET_10_1 = QtGui.QPushButton(self.frame)
         self.OFET_10_1.setGeometry(QtCore.QRect(330, 100, 101, 91))
         self.OFET_10_1.setAutoFillBackground(False)
@@ -775,6 +824,17 @@ class Ui_MainWindow(object):
         self.lineEdit.setAccessibleName(_translate("MainWindow", "OFET_thickness", None))
         self.lineEdit.setPlaceholderText(_translate("MainWindow", "< Film Thickness >", None))
         self.label_32.setText(_translate("MainWindow", "Thickness [nm]", None))
+        self.checkBox_dualSweep.setToolTip(_translate("MainWindow", "Sweep back from the final to the initial voltage", None))
+        self.checkBox_dualSweep.setAccessibleName(_translate("MainWindow", "dualSweep", None))
+        self.checkBox_dualSweep.setText(_translate("MainWindow", "Dual sweep", None))
+        self.label_35.setText(_translate("MainWindow", "Spacing", None))
+        self.comboBox_sweepSpacing.setAccessibleName(_translate("MainWindow", "sweepSpacing", None))
+        self.comboBox_sweepSpacing.setItemText(0, _translate("MainWindow", "LIN", None))
+        self.comboBox_sweepSpacing.setItemText(1, _translate("MainWindow", "LOG", None))
+        self.label_36.setText(_translate("MainWindow", "Bias list [V]", None))
+        self.lineEdit_sweepList.setToolTip(_translate("MainWindow", "Comma separated voltages swept in this order instead of the IV sweep above (eg 0, 5, -5, 0)", None))
+        self.lineEdit_sweepList.setAccessibleName(_translate("MainWindow", "sweepList", None))
+        self.lineEdit_sweepList.setPlaceholderText(_translate("MainWindow", "< none >", None))
         self.label_22.setText(_translate("MainWindow", "Connection", None))
         self.label_12.setText(_translate("MainWindow", "Connection type", None))
         self.label_13.setText(_translate("MainWindow", "Baud Rate", None))
@@ -788,6 +848,7 @@ class Ui_MainWindow(object):
         self.comboBox.setItemText(0, _translate("MainWindow", "Serial", None))
         self.comboBox.setItemText(1, _translate("MainWindow", "GPIB", None))
         self.comboBox.setItemText(2, _translate("MainWindow", "Other", None))
+        self.comboBox.setItemText(3, _translate("MainWindow", "Simulated", None))
         self.comboBox_4.setAccessibleName(_translate("MainWindow", "termChar", None))
         self.comboBox_4.setItemText(0, _translate("MainWindow", "\\r", None))
         self.label_15.setText(_translate("MainWindow", "Serial Adapter", None))
@@ -823,6 +884,17 @@ class Ui_MainWindow(object):
         self.checkBoxQCM4.setText(_translate("MainWindow", "Channel 4", None))
         self.label_26.setText(_translate("MainWindow", "Sample time", None))
         self.doubleSpinBox_5.setAccessibleName(_translate("MainWindow", "QCM_sampleTime", None))
+        self.label_33.setText(_translate("MainWindow", "Target thickness [kA]", None))
+        self.lineEdit_QCM_target.setToolTip(_translate("MainWindow", "Monitoring stops when every channel with a target reaches it. One value for all channels, or one per channel (eg 1.5, , 0.8)", None))
+        self.lineEdit_QCM_target.setAccessibleName(_translate("MainWindow", "QCM_target", None))
+        self.lineEdit_QCM_target.setPlaceholderText(_translate("MainWindow", "< none >", None))
+        self.label_34.setText(_translate("MainWindow", "Warn before target [s]", None))
+        self.doubleSpinBox_QCM_targetWarning.setAccessibleName(_translate("MainWindow", "QCM_targetWarning", None))
+        self.checkBox_insitu.setToolTip(_translate("MainWindow", "Keithley readings at the fixed voltage of the conductivity tab every pause time, joined with the thickness of this channel", None))
+        self.checkBox_insitu.setAccessibleName(_translate("MainWindow", "insitu", None))
+        self.checkBox_insitu.setText(_translate("MainWindow", "In-situ conductivity", None))
+        self.spinBox_insituChannel.setAccessibleName(_translate("MainWindow", "insituChannel", None))
+        self.spinBox_insituChannel.setPrefix(_translate("MainWindow", "QCM ", None))
         self.label_5.setText(_translate("MainWindow", "Feature coming soon...", None))
         self.label_21.setText(_translate("MainWindow", "Experiment Name", None))
         self.label_23.setText(_translate("MainWindow", "Sample", None))
@@ -854,6 +926,9 @@ class Ui_MainWindow(object):
         self.OFET_20_4.setAccessibleName(_translate("MainWindow", "OFET_20_4", None))
         self.pushButton_cond_start.setText(_translate("MainWindow", "Measure", None))
         self.pushButton_cond_stop.setText(_translate("MainWindow", "Cancel", None))
+        self.lineEdit_OFET_devices.setToolTip(_translate("MainWindow", "Measured one after another with the conductivity settings, on every SMU in smuAddresses", None))
+        self.lineEdit_OFET_devices.setAccessibleName(_translate("MainWindow", "OFET_devices", None))
+        self.lineEdit_OFET_devices.setPlaceholderText(_translate("MainWindow", "Devices, eg 20_1, 2p5_4 or all (blank: selected OFET)", None))
         self.OFET_10_1.setToolTip(_translate("MainWindow", "CLICK TO MEASURE", None))
         self.OFET_10_1.setAccessibleName(_translate("MainWindow", "OFET_10_1", None))
         self.OFET_10_2.setToolTip(_translate("MainWindow", "CLICK TO MEASURE", None))